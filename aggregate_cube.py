@@ -0,0 +1,138 @@
+from efficiency_gap import normalize_parties
+import argparse
+import numpy as np
+import os
+import pandas as pd
+
+# the per-state and per-party totals that gerrymandering.Rmd, multi_member_districts.Rmd and
+# efficiency_gap.py group the election table for, kept as dense arrays indexed by
+# state x congress (x party), so a lookup is an index into an array instead of a groupby
+
+party_measures = ["party_votes", "won", "candidates"]
+state_measures = ["sum_votes", "num_elected_state", "num_districts", "races", "uncontested_races"]
+race_columns = ["congress", "type", "year", "election_dates", "state", "district", "trial"]
+
+
+def read_state_areas(path="state_area.csv"):
+    areas = pd.read_csv(path, thousands=",")
+    return dict(zip(areas["State"], areas["Total Area"]))
+
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator else np.nan
+
+
+class AggregateCube:
+    def __init__(self, areas=None):
+        self.labels = {"state": [], "congress": [], "party": []}
+        self.positions = {axis: {} for axis in self.labels}
+        self.areas = areas or {}
+        self.party_cube = np.zeros((0, 0, 0, len(party_measures)))
+        self.state_cube = np.zeros((0, 0, len(state_measures)))
+
+    def positions_of(self, axis, values):
+        # new labels are appended to the axis, and the arrays grown to match
+        positions = self.positions[axis]
+        for value in values:
+            if value not in positions:
+                positions[value] = len(self.labels[axis])
+                self.labels[axis].append(value)
+        shape = tuple(len(self.labels[name]) for name in ("state", "congress", "party"))
+        if self.party_cube.shape[:3] != shape:
+            self.party_cube = np.pad(self.party_cube, [(0, new - old) for new, old in
+                                                       zip(shape + (len(party_measures),), self.party_cube.shape)])
+            self.state_cube = np.pad(self.state_cube, [(0, new - old) for new, old in
+                                                       zip(shape[:2] + (len(state_measures),), self.state_cube.shape)])
+        return np.array([positions[value] for value in values], dtype=int)
+
+    def update(self, data):
+        # every (state, congress) in data is replaced by its totals in data, so data has to hold all
+        # the rows of each of its states and congresses, e.g. a newly parsed or corrected congress
+        data = data[data["state"].notna() & data["congress"].notna()]
+        data = data.assign(party=normalize_parties(data["party"]), won=data["result"] == "won",
+                           standard_votes=data["votes"].where(data["type"] == "StandardElections", 0).fillna(0))
+        races = data.groupby(race_columns, dropna=False, as_index=False)["percentage"].max()
+        states = data.groupby(["state", "congress"]).agg(sum_votes=("standard_votes", "sum"),
+                                                         num_elected_state=("won", "sum"),
+                                                         num_districts=("district", lambda d: d.nunique(dropna=False)))
+        states = states.join(races.assign(uncontested=races["percentage"] > 98).groupby(["state", "congress"])
+                             .agg(races=("uncontested", "size"), uncontested_races=("uncontested", "sum")))
+        parties = data.groupby(["state", "congress", "party"]).agg(party_votes=("standard_votes", "sum"),
+                                                                   won=("won", "sum"),
+                                                                   candidates=("won", "size"))
+        state_positions = self.positions_of("state", states.index.get_level_values("state"))
+        congress_positions = self.positions_of("congress", states.index.get_level_values("congress").astype(int))
+        party_positions = [self.positions_of(axis, values) for axis, values in
+                           (("state", parties.index.get_level_values("state")),
+                            ("congress", parties.index.get_level_values("congress").astype(int)),
+                            ("party", parties.index.get_level_values("party")))]
+        self.party_cube[state_positions, congress_positions] = 0
+        self.party_cube[tuple(party_positions)] = parties[party_measures].to_numpy(float)
+        self.state_cube[state_positions, congress_positions] = states[state_measures].to_numpy(float)
+
+    def state(self, state, congress):
+        totals = dict(zip(state_measures, self.state_cube[self.positions["state"][state],
+                                                           self.positions["congress"][congress]].tolist()))
+        totals["mean_elected_district"] = ratio(totals["num_elected_state"], totals["num_districts"])
+        totals["area"] = self.areas.get(state, np.nan)
+        return totals
+
+    def party(self, state, congress, party):
+        totals = self.state(state, congress)
+        position = self.positions["party"].get(party)
+        values = self.party_cube[self.positions["state"][state], self.positions["congress"][congress], position] \
+            if position is not None else np.zeros(len(party_measures))
+        totals.update(zip(party_measures, values.tolist()))
+        totals["x"] = ratio(totals["party_votes"], totals["sum_votes"])
+        totals["actual"] = ratio(totals["won"], totals["num_elected_state"])
+        totals["theoretical"] = float(np.clip((totals["x"] - .5) * 2 + .5, 0, 1))
+        return totals
+
+    def parties(self, state, congress):
+        # every party with candidates in the state that congress
+        candidates = self.party_cube[self.positions["state"][state], self.positions["congress"][congress], :,
+                                     party_measures.index("candidates")]
+        return [self.labels["party"][position] for position in np.flatnonzero(candidates)]
+
+    def save(self, path):
+        np.savez_compressed(path, party_cube=self.party_cube, state_cube=self.state_cube,
+                            states=np.array(self.labels["state"], dtype=str),
+                            congresses=np.array(self.labels["congress"], dtype=int),
+                            parties=np.array(self.labels["party"], dtype=str),
+                            area_states=np.array(list(self.areas), dtype=str),
+                            areas=np.array(list(self.areas.values()), dtype=float))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            cube = cls(dict(zip(arrays["area_states"].tolist(), arrays["areas"].tolist())))
+            for axis, name in (("state", "states"), ("congress", "congresses"), ("party", "parties")):
+                cube.labels[axis] = arrays[name].tolist()
+                cube.positions[axis] = {value: i for i, value in enumerate(cube.labels[axis])}
+            cube.party_cube = arrays["party_cube"]
+            cube.state_cube = arrays["state_cube"]
+        return cube
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input", nargs="?", help="rows to add, e.g. output_with_incumbency.csv")
+    arg_parser.add_argument("--cube", default="aggregate_cube.npz")
+    arg_parser.add_argument("--areas", default="state_area.csv")
+    arg_parser.add_argument("--state")
+    arg_parser.add_argument("--congress", type=int)
+    arg_parser.add_argument("--party")
+    args = arg_parser.parse_args()
+    if os.path.exists(args.cube):
+        cube = AggregateCube.load(args.cube)
+    else:
+        cube = AggregateCube(read_state_areas(args.areas))
+    if args.input:
+        cube.update(pd.read_csv(args.input, keep_default_na=False, na_values=[""]))
+        cube.save(args.cube)
+    if args.state:
+        if args.party:
+            print(cube.party(args.state, args.congress, args.party))
+        else:
+            print(cube.state(args.state, args.congress))
+            print(cube.parties(args.state, args.congress))
@@ -0,0 +1,221 @@
+from bs4 import BeautifulSoup
+import argparse
+import csv
+import gc
+import hashlib
+import io
+import json
+import random
+import resource
+import sys
+import time
+import parser
+
+# synthetic pages laid out the way onlineocr.net rendered the Dubin volume (see example.html)
+
+first_names = ["John", "Samuel", "William", "Thomas", "James", "Daniel", "Josiah", "Elisha", "Benjamin", "Jonathan"]
+last_names = ["Adams", "Sherman", "Huntington", "Wadsworth", "McLane", "Naudain", "Tatnall", "Forsyth", "Lumpkin",
+              "Haynes", "Sturges", "Trumbull"]
+parties = ["F", "D-R", "J", "A-J", "NR", "W", "D"]
+state_names = ["Connecticut", "Delaware", "Georgia", "Maine", "Maryland", "Massachusetts", "New Hampshire",
+               "New Jersey", "New York", "North Carolina", "Pennsylvania", "Rhode Island", "South Carolina", "Vermont",
+               "Virginia"]
+months = ["Jan.", "Feb.", "Mar.", "Apr.", "Aug.", "Sept.", "Oct.", "Nov.", "Dec."]
+
+
+def ordinal(number):
+    if number % 100 in (11, 12, 13):
+        return "%dth" % number
+    return "%d%s" % (number, {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th"))
+
+
+def font_span(size, text, style=None):
+    style = ' style="%s"' % style if style else ""
+    return ('<font color="#000000"><span style="text-decoration: none"><font face="Times New Roman, serif">'
+            '<font size="%s"%s><span style="letter-spacing: normal"><span lang="en-US">%s</span></span>'
+            '</font></font></span></font>\n' % (size, style, text))
+
+
+def candidate_spans(rng, votes, percentage):
+    name = "%s\n    %s" % (rng.choice(first_names), rng.choice(last_names))
+    text = "%s (%s) %s (%.2f)" % (name, rng.choice(parties), "{:,}".format(votes), percentage)
+    if rng.random() < 0.3:
+        # OCR often breaks a candidate across spans, and sometimes leaves a linebreak inside one
+        split = text.index(")") + 1
+        return [font_span(1, text[:split], "font-size: 7pt"), font_span(1, text[split:] + "<br/>", "font-size: 7pt")]
+    return [font_span(1, text, "font-size: 7pt")]
+
+
+def district_spans(rng, number, candidates):
+    html = [font_span(1, "<i>%s\n    District</i>" % ordinal(number), "font-size: 7pt")]
+    votes = [rng.randint(100, 5000) for _ in range(candidates)]
+    for count in votes:
+        html += candidate_spans(rng, count, 100.0 * count / sum(votes))
+    return html
+
+
+def synthetic_html(congresses=10, states=10, districts=6, candidates=3, seed=0):
+    rng = random.Random(seed)
+    html = ['<html><head><meta http-equiv="content-type" content="text/html; charset=utf-8"/></head><body>\n']
+    for congress in range(1, congresses + 1):
+        year = 1786 + 2 * congress
+        html.append('<p align="center">' + font_span(
+            6, "<b>%s\n    Congress :%d-%d</b>" % (ordinal(congress), year + 1, year + 3), "font-size: 26pt") + "</p>")
+        html.append('<div id="TextSection" style="column-count: 4">\n')
+        html.append(font_span(3, str(year), "font-size: 12pt"))
+        for state in rng.sample(state_names, min(states, len(state_names))):
+            html.append(font_span(2, "%s\n    (%s" % (state, rng.choice(months)), "font-size: 9pt"))
+            html.append(font_span(1, "%d)" % rng.randint(1, 28), "font-size: 7pt"))
+            for district in range(1, districts + 1):
+                html += district_spans(rng, district, candidates)
+        html.append("</div>\n")
+        html.append(font_span(5, "<b>Runoff\n    Elections</b>", "font-size: 17pt"))
+        for state in rng.sample(state_names, min(2, len(state_names))):
+            html.append(font_span(2, state, "font-size: 9pt"))
+            html.append(font_span(2, "2nd\n    Trial", "font-size: 9pt"))
+            html.append(font_span(1, "<b>(%s\n    %d,</b>" % (rng.choice(months), rng.randint(1, 28)), "font-size: 7pt"))
+            html.append(font_span(1, "%d)" % (year + 1), "font-size: 7pt"))
+            html += district_spans(rng, 1, 2)
+    html.append("</body></html>\n")
+    return "".join(html)
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+
+    def add(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0) + seconds
+
+    def timed(self, stage, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+
+def run_benchmark(html):
+    timer = StageTimer()
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, "lxml")
+    timer.add("soup load", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for e in soup.find_all('br'):
+        e.extract()
+    timer.add("br stripping", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tags = soup.find_all(parser.is_valid_span)
+    timer.add("is_valid_span filtering", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    spans = [parser.classify_span(tag) for tag in tags]
+    timer.add("span classification", time.perf_counter() - start)
+
+    # parse_candidates is looked up as a module global by the hierarchy, so it can be wrapped in place
+    parse_candidates = parser.parse_candidates
+    parser.parse_candidates = timer.timed("candidate scoring", parse_candidates)
+    try:
+        rows = []
+        start = time.perf_counter()
+        parser.parse_out_congress(spans, rows)
+        timer.add("hierarchy descent", time.perf_counter() - start - timer.times.get("candidate scoring", 0))
+    finally:
+        parser.parse_candidates = parse_candidates
+
+    start = time.perf_counter()
+    writer = csv.writer(io.StringIO())
+    writer.writerow(parser.fieldnames)
+    writer.writerows(rows)
+    timer.add("csv write", time.perf_counter() - start)
+
+    total = sum(timer.times.values())
+    return {
+        "spans": len(spans),
+        "rows": len(rows),
+        "html_bytes": len(html),
+        "stages": timer.times,
+        "total_seconds": total,
+        "spans_per_second": len(spans) / total,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def repeat_benchmark(html, repeats=5, warmup=1):
+    # single runs vary by 20% or more, so each stage keeps its fastest time over the repeats, after
+    # untimed warm-up runs; the total is that of the fastest run. As in timeit, the garbage collector
+    # is kept out of the timed runs.
+    for _ in range(warmup):
+        run_benchmark(html)
+    runs = []
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            runs.append(run_benchmark(html))
+        finally:
+            gc.enable()
+    report = min(runs, key=lambda run: run["total_seconds"])
+    report["stages"] = {stage: min(run["stages"][stage] for run in runs) for stage in report["stages"]}
+    report["repeats"] = repeats
+    report["peak_rss_mb"] = runs[-1]["peak_rss_mb"]
+    return report
+
+
+def corpus_id(html, **parameters):
+    # throughput depends on the corpus, so a report is only compared with one from the same input
+    return dict(parameters, sha1=hashlib.sha1(html.encode()).hexdigest())
+
+
+def print_report(report):
+    print("%d spans, %d rows, %.1f MB of HTML" % (report["spans"], report["rows"], report["html_bytes"] / 1e6))
+    for stage, seconds in report["stages"].items():
+        print("  %-25s %8.3fs" % (stage, seconds))
+    print("  %-25s %8.3fs" % ("total", report["total_seconds"]))
+    print("%.0f spans/sec (fastest of %d runs), peak RSS %.0f MB" % (report["spans_per_second"], report["repeats"],
+                                                                     report["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--congresses", type=int, default=10)
+    arg_parser.add_argument("--states", type=int, default=10)
+    arg_parser.add_argument("--districts", type=int, default=6)
+    arg_parser.add_argument("--candidates", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--input", help="benchmark a real OCR file instead of a synthetic one")
+    arg_parser.add_argument("--repeats", type=int, default=5, help="number of timed runs")
+    arg_parser.add_argument("--warmup", type=int, default=1, help="number of untimed runs first")
+    arg_parser.add_argument("--save", help="write the report to this JSON file")
+    arg_parser.add_argument("--baseline", help="JSON report to compare throughput against")
+    arg_parser.add_argument("--threshold", type=float, default=0.2,
+                            help="fail if spans/sec drops by more than this fraction of the baseline")
+    args = arg_parser.parse_args()
+
+    if args.input:
+        with open(args.input) as input_file:
+            html = input_file.read()
+        corpus = corpus_id(html, input=args.input)
+    else:
+        html = synthetic_html(args.congresses, args.states, args.districts, args.candidates, args.seed)
+        corpus = corpus_id(html, congresses=args.congresses, states=args.states, districts=args.districts,
+                           candidates=args.candidates, seed=args.seed)
+    report = repeat_benchmark(html, args.repeats, args.warmup)
+    report["corpus"] = corpus
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as save_file:
+            json.dump(report, save_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("corpus", {}).get("sha1") != corpus["sha1"]:
+            sys.exit("%s was not run on the same corpus (%s)" % (args.baseline, baseline.get("corpus", "unknown")))
+        change = report["spans_per_second"] / baseline["spans_per_second"] - 1
+        print("%+.1f%% spans/sec against %s" % (100 * change, args.baseline))
+        if change < -args.threshold:
+            sys.exit("throughput regressed by more than %.0f%%" % (100 * args.threshold))
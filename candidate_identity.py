@@ -0,0 +1,119 @@
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+import json
+import re
+
+# OCR spells the same person several ways ("JohnQAdams", "JohnQuincyAdams", "RogerSberman").
+# Each state keeps an inverted index from name trigrams to the people whose names contain them,
+# so a new name is only compared against the few people it shares trigrams with.
+
+max_candidates = 20
+min_ratio = .9
+
+
+def trigrams(clean_name):
+    padded = "^^" + clean_name.lower() + "$$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_parts(clean_name):
+    # clean names have no spaces left, but keep their capitals
+    return re.findall("[A-Z][^A-Z]*", clean_name) or [clean_name]
+
+
+def given_names_conflict(parts_a, parts_b):
+    # two different initials or given names in the same place, as in WilliamNIrvine and WilliamAIrvine
+    # or JonathanGrout and JohnGrout; a missing middle initial is no conflict
+    given_a, given_b = parts_a[:-1], parts_b[:-1]
+    if len(given_a) != len(given_b):
+        given_a, given_b = given_a[:1], given_b[:1]
+    return any(not (x.startswith(y) or y.startswith(x)) and
+               (len(x) == 1 or len(y) == 1 or SequenceMatcher(None, x, y).ratio() < min_ratio)
+               for x, y in zip(given_a, given_b))
+
+
+def compatible(a, b):
+    return not given_names_conflict(name_parts(a), name_parts(b))
+
+
+def same_person(a, b):
+    parts_a, parts_b = name_parts(a), name_parts(b)
+    if given_names_conflict(parts_a, parts_b):
+        return False
+    if len(parts_a) == len(parts_b) and parts_a[-1] == parts_b[-1] and \
+            all(x.startswith(y) or y.startswith(x) for x, y in zip(parts_a[:-1], parts_b[:-1])):
+        # the same surname, with initials standing in for some given names
+        return True
+    # otherwise only a character or so of OCR noise
+    return abs(len(a) - len(b)) <= 1 and SequenceMatcher(None, a, b).ratio() >= min_ratio
+
+
+class IdentityIndex:
+    def __init__(self):
+        self.names = {}  # (state, clean_name) -> person_id
+        self.postings = defaultdict(lambda: defaultdict(set))  # state -> trigram -> person_ids
+        self.people = []  # person_id -> (state, clean names seen)
+
+    def find(self, state, clean_name):
+        if (state, clean_name) in self.names:
+            return self.names[state, clean_name]
+        postings = self.postings[state]
+        shared = Counter(person_id for gram in trigrams(clean_name) for person_id in postings.get(gram, ()))
+        for person_id, count in shared.most_common(max_candidates):
+            if count < 2:
+                break
+            # a name close to one of the person's names, but conflicting with none, so that variants
+            # like WilliamIrvine cannot chain WilliamNIrvine and WilliamAIrvine into one person
+            names = self.people[person_id][1]
+            if any(same_person(clean_name, name) for name in names) and \
+                    all(compatible(clean_name, name) for name in names):
+                return person_id
+        return None
+
+    def add(self, state, clean_name, person_id=None):
+        if person_id is None:
+            person_id = len(self.people)
+            self.people.append((state, []))
+        self.names[state, clean_name] = person_id
+        self.people[person_id][1].append(clean_name)
+        for gram in trigrams(clean_name):
+            self.postings[state][gram].add(person_id)
+        return person_id
+
+    def resolve(self, state, clean_name):
+        # the person_id for this name, adding a new person if nobody in the state matches
+        person_id = self.find(state, clean_name)
+        if (state, clean_name) not in self.names:
+            person_id = self.add(state, clean_name, person_id)
+        return person_id
+
+    def find_anywhere(self, clean_name):
+        # for sources without a state, like the roll call in vote_record.csv
+        for state in self.postings:
+            person_id = self.find(state, clean_name)
+            if person_id is not None:
+                return person_id
+        return None
+
+    def save(self, path):
+        with open(path, "w") as index_file:
+            json.dump(self.people, index_file)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path) as index_file:
+            for person_id, (state, names) in enumerate(json.load(index_file)):
+                index.people.append((state, []))
+                for name in names:
+                    index.add(state, name, person_id)
+        return index
+
+
+def assign_person_ids(data, index=None):
+    # rows are resolved in congress order, so a person's id is the one from their first race, and
+    # congresses parsed later can be resolved against a saved index without renumbering anyone
+    index = IdentityIndex() if index is None else index
+    keys = list(zip(data["state"].fillna("").astype(str), data["clean_name"]))
+    ids = {key: index.resolve(*key) for key in keys}
+    return data.assign(person_id=[ids[key] for key in keys])
@@ -0,0 +1,61 @@
+import pandas as pd
+
+# fixed column types for the election tables, so every reader gets the same schema back
+# instead of re-inferring it from text
+election_types = {
+    "congress": "Int16",
+    "type": "category",
+    "year": "string",
+    "election_dates": "string",
+    "state": "category",
+    "district": "string",
+    "runoff": "boolean",
+    "trial": "Int8",
+    "num_elected": "Int8",
+    "name": "string",
+    "party": "category",
+    "votes": "Int64",
+    "percentage": "float64",
+    "result": "category",
+    "incumbent": "boolean",
+    "old_vote_share": "float64",
+    "clean_name": "string",
+    "vote_id": "category",
+    "vote": "category"
+}
+
+numeric_types = {"Int8", "Int16", "Int64", "float64"}
+
+
+def to_typed_frame(frame):
+    frame = frame.copy()
+    for column, column_type in election_types.items():
+        if column not in frame:
+            continue
+        values = frame[column]
+        if column_type in numeric_types:
+            values = pd.to_numeric(values, errors="coerce")
+        elif column_type == "boolean":
+            values = values.map({True: True, False: False, "True": True, "False": False})
+        frame[column] = values.astype(column_type)
+    return frame
+
+
+def is_arrow_path(path):
+    return str(path).endswith((".arrow", ".feather"))
+
+
+def write_table(frame, path):
+    # .arrow/.feather files are Arrow IPC and can be memory-mapped; anything else is written as Parquet
+    frame = to_typed_frame(frame)
+    if is_arrow_path(path):
+        frame.reset_index(drop=True).to_feather(path, compression="uncompressed")
+    else:
+        frame.to_parquet(path, index=False)
+
+
+def read_table(path, columns=None):
+    if is_arrow_path(path):
+        import pyarrow.feather as feather
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_parquet(path, columns=columns, memory_map=True)
@@ -0,0 +1,84 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# the same computation as the grouped_states and filtered pipelines in gerrymandering.Rmd
+
+major_parties = ["D", "DR", "W", "F", "R", "NR", "U", "A"]
+party_renames = {"Ad": "NR", "f": "F", "a-f": "AF", "J": "D"}
+
+filtered_columns = ["state", "congress", "party", "theoretical", "actual", "num_elected_state", "num_districts", "x",
+                    "mean_elected_district", "sign", "simple_efficiency_gap", "census", "seat_advantage",
+                    "theoretical_2", "modified_efficiency_gap"]
+
+
+def normalize_parties(party):
+    # subparties after a dash are dropped, so D-R has to be renamed first
+    party = party.fillna("").astype(str).replace("D-R", "DR").str.split("-", n=1).str[0]
+    return party.replace(party_renames)
+
+
+def seat_shares(data):
+    data = data.assign(party=normalize_parties(data["party"]),
+                       won=data["result"] == "won",
+                       standard_votes=data["votes"].where(data["type"] == "StandardElections", 0))
+    states = data.groupby(["state", "congress"]).agg(sum_votes=("standard_votes", "sum"),
+                                                     num_elected_state=("won", "sum"),
+                                                     num_districts=("district", lambda d: d.nunique(dropna=False)))
+    parties = data.groupby(["state", "congress", "party"]).agg(party_votes=("standard_votes", "sum"),
+                                                               won=("won", "sum"))
+    shares = parties.join(states, on=["state", "congress"]).reset_index()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares["x"] = shares["party_votes"] / shares["sum_votes"]
+        shares["actual"] = shares["won"] / shares["num_elected_state"]
+    shares["theoretical"] = ((shares["x"] - .5) * 2 + .5).clip(0, 1)
+    shares["mean_elected_district"] = shares["num_elected_state"] / shares["num_districts"]
+    return shares.drop(columns=["party_votes", "won", "sum_votes"])
+
+
+def update_seat_shares(shares, data, changed):
+    # recompute only the (state, congress) groups listed in changed, e.g. after correcting a few races
+    changed = pd.MultiIndex.from_frame(pd.DataFrame(changed, columns=["state", "congress"]))
+    keep = ~pd.MultiIndex.from_frame(shares[["state", "congress"]]).isin(changed)
+    redo = pd.MultiIndex.from_frame(data[["state", "congress"]]).isin(changed)
+    updated = pd.concat([shares[keep], seat_shares(data[redo])])
+    return updated.sort_values(["state", "congress", "party"], kind="stable").reset_index(drop=True)
+
+
+def floored_gap(actual, theoretical, num_elected_state):
+    # the gap in whole seats, as a share of the state's seats
+    sign = np.where(actual - theoretical > 0, 1, -1)
+    return sign, sign * np.floor(np.abs(actual - theoretical) * num_elected_state) / num_elected_state
+
+
+def modified_theoretical(filtered):
+    # states with fewer districts swing further from an even split, so the seat share is
+    # predicted from the vote share and the number of districts
+    design = np.column_stack([np.ones(len(filtered)), np.abs(filtered["x"] - .5), np.log(filtered["num_districts"])])
+    coefficients = np.linalg.lstsq(design, np.abs(filtered["actual"] - .5), rcond=None)[0]
+    prediction = .5 + np.where(filtered["x"] < .5, -1, 1) * (design @ coefficients)
+    return np.clip(prediction, 0, 1)
+
+
+def efficiency_gaps(shares):
+    filtered = shares[(shares["party"] != "") & shares["theoretical"].notna() & shares["actual"].notna() &
+                      (shares["num_districts"] > 0)].copy()
+    filtered["sign"], filtered["simple_efficiency_gap"] = floored_gap(filtered["actual"], filtered["theoretical"],
+                                                                      filtered["num_elected_state"])
+    filtered = filtered[filtered["party"].isin(major_parties)].copy()
+    filtered["census"] = (filtered["congress"] + 2) // 5
+    filtered["seat_advantage"] = filtered["simple_efficiency_gap"] * filtered["num_elected_state"]
+    filtered["theoretical_2"] = modified_theoretical(filtered)
+    filtered["sign"], filtered["modified_efficiency_gap"] = floored_gap(filtered["actual"], filtered["theoretical_2"],
+                                                                        filtered["num_elected_state"])
+    return filtered[filtered_columns].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input", nargs="?", default="output_with_incumbency.csv")
+    arg_parser.add_argument("--output", default="filtered.csv")
+    args = arg_parser.parse_args()
+    filtered = efficiency_gaps(seat_shares(pd.read_csv(args.input, keep_default_na=False, na_values=[""])))
+    filtered.index += 1  # R's row names
+    filtered.to_csv(args.output)
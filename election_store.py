@@ -0,0 +1,192 @@
+import argparse
+import sqlite3
+import string
+
+punc_translator = str.maketrans('', '', string.punctuation)
+space_translator = str.maketrans('', '', string.whitespace)
+
+# one row per race, one per distinct candidate name and party, and one per candidate in a race
+schema = """
+CREATE TABLE IF NOT EXISTS party (
+    party_id INTEGER PRIMARY KEY,
+    abbreviation TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS candidate (
+    candidate_id INTEGER PRIMARY KEY,
+    clean_name TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS election (
+    election_id INTEGER PRIMARY KEY,
+    congress INTEGER,
+    type TEXT NOT NULL,
+    year TEXT NOT NULL,
+    election_dates TEXT NOT NULL,
+    state TEXT NOT NULL,
+    district TEXT NOT NULL,
+    trial INTEGER,
+    num_elected INTEGER,
+    UNIQUE (congress, type, year, election_dates, state, district, trial, num_elected)
+);
+CREATE TABLE IF NOT EXISTS result (
+    election_id INTEGER NOT NULL REFERENCES election,
+    candidate_id INTEGER NOT NULL REFERENCES candidate,
+    party_id INTEGER REFERENCES party,
+    runoff INTEGER,
+    votes INTEGER,
+    percentage REAL,
+    result TEXT,
+    incumbent INTEGER,
+    old_vote_share REAL
+);
+CREATE INDEX IF NOT EXISTS election_state_congress ON election (state, congress);
+CREATE INDEX IF NOT EXISTS election_congress_state_district ON election (congress, state, district);
+CREATE UNIQUE INDEX IF NOT EXISTS candidate_clean_name ON candidate (clean_name, name);
+CREATE INDEX IF NOT EXISTS result_election ON result (election_id);
+CREATE INDEX IF NOT EXISTS result_candidate ON result (candidate_id);
+CREATE VIEW IF NOT EXISTS election_result AS
+    SELECT election.congress, election.type, election.year, election.election_dates, election.state,
+           election.district, result.runoff, election.trial, election.num_elected, candidate.name,
+           party.abbreviation AS party, result.votes, result.percentage, result.result, result.incumbent,
+           result.old_vote_share, candidate.clean_name
+    FROM result
+    JOIN election USING (election_id)
+    JOIN candidate USING (candidate_id)
+    LEFT JOIN party USING (party_id);
+"""
+
+election_columns = ["congress", "type", "year", "election_dates", "state", "district", "trial", "num_elected"]
+integer_columns = {"congress", "trial", "num_elected"}
+
+
+def missing(value):
+    # None from the parser, NaN from pandas
+    return value is None or value != value or value == ""
+
+
+def text_key(value):
+    # the election key is UNIQUE, and SQLite treats every NULL as distinct, so blanks are stored as ""
+    return "" if missing(value) else str(value)
+
+
+def integer_key(value):
+    # the same conversion SQLite applies to an INTEGER column, so keys read back match the ones inserted
+    if missing(value):
+        return ""
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def optional_value(value):
+    return None if missing(value) else value
+
+
+def flag_value(value):
+    if missing(value):
+        return None
+    return int(value in (True, "True"))
+
+
+def clean_name(name):
+    return str(name).translate(punc_translator).translate(space_translator)
+
+
+class ElectionStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ids(self, table, key_columns):
+        id_column = table + "_id"
+        query = "SELECT %s, %s FROM %s" % (", ".join(key_columns), id_column, table)
+        return {tuple(row[:-1]): row[-1] for row in self.connection.execute(query)}
+
+    def load(self, rows, keep=()):
+        # rows are dicts shaped like the parser (or incumbency_analysis) output. Any congress in rows
+        # replaces what was stored for it, so re-loading a re-parsed congress does not duplicate it,
+        # except those in keep, which were loaded earlier in the same run. Returns the congresses loaded.
+        rows = list(rows)
+        elections = [tuple(integer_key(row.get(column)) if column in integer_columns else text_key(row.get(column))
+                           for column in election_columns) for row in rows]
+        candidates = [(text_key(row.get("clean_name")) or clean_name(row.get("name")), text_key(row.get("name")))
+                      for row in rows]
+        parties = [optional_value(row.get("party")) for row in rows]
+        loaded = {election[0] for election in elections}
+        congresses = [(congress,) for congress in loaded.difference(keep)]
+        with self.connection:
+            self.connection.executemany("DELETE FROM result WHERE election_id IN "
+                                        "(SELECT election_id FROM election WHERE congress = ?)", congresses)
+            self.connection.executemany("DELETE FROM election WHERE congress = ?", congresses)
+            self.connection.executemany("INSERT OR IGNORE INTO party (abbreviation) VALUES (?)",
+                                        {(party,) for party in parties if party is not None})
+            self.connection.executemany("INSERT OR IGNORE INTO candidate (clean_name, name) VALUES (?, ?)",
+                                        set(candidates))
+            self.connection.executemany("INSERT OR IGNORE INTO election (%s) VALUES (%s)" % (
+                ", ".join(election_columns), ", ".join("?" * len(election_columns))), dict.fromkeys(elections))
+            party_ids = self.ids("party", ["abbreviation"])
+            candidate_ids = self.ids("candidate", ["clean_name", "name"])
+            election_ids = self.ids("election", election_columns)
+            self.connection.executemany(
+                "INSERT INTO result (election_id, candidate_id, party_id, runoff, votes, percentage, result, "
+                "incumbent, old_vote_share) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((election_ids[election], candidate_ids[candidate],
+                  party_ids[(party,)] if party is not None else None, flag_value(row.get("runoff")),
+                  optional_value(row.get("votes")), optional_value(row.get("percentage")),
+                  optional_value(row.get("result")), flag_value(row.get("incumbent")),
+                  optional_value(row.get("old_vote_share")))
+                 for row, election, candidate, party in zip(rows, elections, candidates, parties)))
+        return loaded
+
+    def query(self, where="", parameters=()):
+        query = "SELECT * FROM election_result"
+        if where:
+            query += " WHERE " + where
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+    def races_in_state(self, state, first_congress=None, last_congress=None):
+        # e.g. every race in Virginia for congresses 20 through 28
+        where, parameters = "state = ?", [state]
+        if first_congress is not None:
+            where, parameters = where + " AND congress >= ?", parameters + [first_congress]
+        if last_congress is not None:
+            where, parameters = where + " AND congress <= ?", parameters + [last_congress]
+        return self.query(where, parameters)
+
+    def candidate_elections(self, name):
+        # name can be written either way, e.g. "Roger Sherman" or "RogerSherman"
+        return self.query("clean_name = ?", (clean_name(name),))
+
+    def race(self, congress, state, district):
+        return self.query("congress = ? AND state = ? AND district = ?", (congress, state, district))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("database")
+    arg_parser.add_argument("--state")
+    arg_parser.add_argument("--congresses", type=int, nargs=2, metavar=("FIRST", "LAST"))
+    arg_parser.add_argument("--district", help="with --state and a single congress, the races for one district")
+    arg_parser.add_argument("--candidate", help="every race involving this candidate")
+    args = arg_parser.parse_args()
+    with ElectionStore(args.database) as store:
+        if args.candidate:
+            results = store.candidate_elections(args.candidate)
+        elif args.district:
+            results = store.race(args.congresses[0], args.state, args.district)
+        else:
+            results = store.races_in_state(args.state, *(args.congresses or ()))
+    for result in results:
+        print(result)
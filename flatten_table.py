@@ -1,8 +1,85 @@
-from bs4 import BeautifulSoup
-soup = BeautifulSoup(open("problem_table.html"))
-output = ""
-for i in range(4):
-    for row in soup.find("tbody").find_all("tr", recursive=False):
-        for column_children in row.find_all("td", recursive=False)[i].find_all(recursive=False):
-            output += str(column_children)
-print(output)
+import argparse
+import io
+
+# the OCR sometimes reads a multi-column page as one table, with each row holding a slice of every
+# column. Flattening reads the cells out column by column, which is the order the page is read in.
+
+
+def table_rows(table):
+    rows = table.find_all("tr", recursive=False)
+    for section in table.find_all(["thead", "tbody", "tfoot"], recursive=False):
+        rows += section.find_all("tr", recursive=False)
+    return rows
+
+
+def column_count(table):
+    return max((len(row.find_all("td", recursive=False)) for row in table_rows(table)), default=0)
+
+
+def column_fragments(table):
+    # one pass over the rows; the number of columns is the widest row
+    columns = []
+    for row in table_rows(table):
+        for i, cell in enumerate(row.find_all("td", recursive=False)):
+            if i == len(columns):
+                columns.append([])
+            columns[i] += cell.find_all(recursive=False)
+    return [fragment for column in columns for fragment in column]
+
+
+def flatten_table(html):
+    # html holds one broken table; returns its contents in reading order, or html itself if it has
+    # no table (problem_table.html, for one, has none)
+    from bs4 import BeautifulSoup
+    if hasattr(html, "read"):
+        html = html.read()
+    table = BeautifulSoup(html, "lxml").find("table")
+    if table is None:
+        return html
+    output = io.StringIO()
+    for fragment in column_fragments(table):
+        output.write(str(fragment))
+    return output.getvalue()
+
+
+def flatten_tables(soup, min_columns=2):
+    # replaces every table of at least min_columns columns in a parsed batch file with its contents,
+    # moving the tags rather than re-serializing them. Returns the number of tables flattened.
+    flattened = 0
+    for table in soup.find_all("table"):
+        # tables left inside one that was flattened have been destroyed with it
+        if table.parent is None or column_count(table) < min_columns:
+            continue
+        for fragment in column_fragments(table):
+            table.insert_before(fragment.extract())
+        table.decompose()
+        flattened += 1
+    return flattened
+
+
+def flattened_html(path, min_columns=2):
+    # a batch file with its tables flattened, as the bytes parser.parse_html reads
+    from bs4 import BeautifulSoup
+    with open(path) as input_file:
+        soup = BeautifulSoup(input_file, "lxml")
+    flatten_tables(soup, min_columns)
+    return str(soup).encode()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("inputs", nargs="*", default=["problem_table.html"])
+    arg_parser.add_argument("--in-place", action="store_true",
+                            help="rewrite each batch file with its tables flattened, instead of printing them")
+    args = arg_parser.parse_args()
+    from bs4 import BeautifulSoup
+    for path in args.inputs:
+        with open(path) as input_file:
+            if not args.in_place:
+                print(flatten_table(input_file))
+                continue
+            soup = BeautifulSoup(input_file, "lxml")
+        count = flatten_tables(soup)
+        with open(path, "w") as output_file:
+            output_file.write(str(soup))
+        print("%s: flattened %d tables" % (path, count))
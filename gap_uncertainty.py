@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+from efficiency_gap import efficiency_gaps, floored_gap, normalize_parties, seat_shares
+import argparse
+import numpy as np
+import pandas as pd
+
+# confidence intervals for the efficiency gaps in filtered.csv. Each draw perturbs the vote table,
+# either with multiplicative noise on every vote count (for OCR errors) or by resampling the races
+# of each state and congress (a bootstrap), and recomputes both gaps. Who won is taken as recorded.
+# A batch of draws is one (draws x candidates) array, reduced to the filtered.csv rows with reduceat.
+
+race_columns = ["congress", "type", "year", "election_dates", "state", "district", "trial"]
+
+
+def gap_inputs(data):
+    # the candidates of every state and congress that has a row in filtered.csv, sorted so that each
+    # state and congress, and each party within it, is a contiguous run
+    point = efficiency_gaps(seat_shares(data))
+    data = data.assign(party=normalize_parties(data["party"]),
+                       race=data.groupby(race_columns, dropna=False).ngroup())
+    states = point[["state", "congress"]].drop_duplicates().reset_index(drop=True)
+    data = data.merge(states.reset_index().rename(columns={"index": "sc"}), on=["state", "congress"])
+    data = data.merge(point[["state", "congress", "party"]].reset_index().rename(columns={"index": "target"}),
+                      on=["state", "congress", "party"], how="left")
+    data["target"] = data["target"].fillna(-1).astype(int)
+    data = data.sort_values(["sc", "target"], kind="stable").reset_index(drop=True)
+
+    # races are renumbered so that each state and congress owns a contiguous range of them
+    race = data["race"].factorize()[0]
+    race_sc = data.groupby(race)["sc"].first().to_numpy()
+    segments = np.flatnonzero(np.r_[True, (np.diff(data["sc"]) != 0) | (np.diff(data["target"]) != 0)])
+    segment_target = data["target"].to_numpy()[segments]
+    return point, {
+        "votes": data["votes"].where(data["type"] == "StandardElections", 0).fillna(0).to_numpy(float),
+        "won": (data["result"] == "won").to_numpy(float),
+        "race": race,
+        "race_start": np.searchsorted(race_sc, np.arange(len(states))),
+        "race_count": np.bincount(race_sc, minlength=len(states)),
+        "race_sc": race_sc,
+        "sc_starts": np.flatnonzero(np.r_[True, np.diff(data["sc"]) != 0]),
+        "segments": segments,
+        "target_segments": np.flatnonzero(segment_target >= 0),
+        "target_sc": point.merge(states.reset_index(), on=["state", "congress"])["index"].to_numpy(),
+        "log_districts": np.log(point["num_districts"].to_numpy(float))
+    }
+
+
+def race_weights(inputs, draws, rng):
+    # how often each race is picked when every state's races are resampled with replacement
+    race_sc = inputs["race_sc"]
+    picks = inputs["race_start"][race_sc] + (rng.random((draws, len(race_sc))) *
+                                             inputs["race_count"][race_sc]).astype(int)
+    picks += np.arange(draws)[:, None] * len(race_sc)
+    return np.bincount(picks.ravel(), minlength=draws * len(race_sc)).reshape(draws, len(race_sc))
+
+
+def batched_theoretical(x, actual, log_districts):
+    # modified_theoretical fitted separately for every draw, through the normal equations
+    design = np.stack([np.ones_like(x), np.abs(x - .5), np.broadcast_to(log_districts, x.shape)], axis=2)
+    valid = np.isfinite(x) & np.isfinite(actual)
+    design = np.where(valid[:, :, None], design, 0)
+    target = np.where(valid, np.abs(actual - .5), 0)
+    coefficients = np.linalg.solve(np.einsum("dni,dnj->dij", design, design),
+                                   np.einsum("dni,dn->di", design, target)[:, :, None])
+    prediction = .5 + np.where(x < .5, -1, 1) * (design @ coefficients)[:, :, 0]
+    return np.where(valid, np.clip(prediction, 0, 1), np.nan)
+
+
+def draw_gaps(inputs, draws, method="noise", noise=.05, seed=None):
+    rng = np.random.default_rng(seed)
+    votes = np.broadcast_to(inputs["votes"], (draws, len(inputs["votes"])))
+    won = np.broadcast_to(inputs["won"], votes.shape)
+    if method == "bootstrap":
+        weights = race_weights(inputs, draws, rng)[:, inputs["race"]]
+        votes, won = votes * weights, won * weights
+    else:
+        votes = votes * np.clip(1 + noise * rng.standard_normal(votes.shape), 0, None)
+    sc_votes = np.add.reduceat(votes, inputs["sc_starts"], axis=1)[:, inputs["target_sc"]]
+    sc_won = np.add.reduceat(won, inputs["sc_starts"], axis=1)[:, inputs["target_sc"]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # candidates of parties without a row in filtered.csv have segments of their own, dropped here
+        x = np.add.reduceat(votes, inputs["segments"], axis=1)[:, inputs["target_segments"]] / sc_votes
+        actual = np.add.reduceat(won, inputs["segments"], axis=1)[:, inputs["target_segments"]] / sc_won
+        theoretical = np.clip((x - .5) * 2 + .5, 0, 1)
+        simple = floored_gap(actual, theoretical, sc_won)[1]
+        modified = floored_gap(actual, batched_theoretical(x, actual, inputs["log_districts"]), sc_won)[1]
+    # a bootstrap draw can leave a state without votes or winners, which has no gap
+    missing = ~(np.isfinite(x) & np.isfinite(actual))
+    return np.where(missing, np.nan, simple), np.where(missing, np.nan, modified)
+
+
+def gap_intervals(data, draws=10000, method="noise", noise=.05, level=.95, batch_size=200, workers=None, seed=0):
+    point, inputs = gap_inputs(data)
+    sizes = [min(batch_size, draws - start) for start in range(0, draws, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ProcessPoolExecutor(workers) as pool:
+        batches = list(pool.map(draw_gaps, [inputs] * len(sizes), sizes, [method] * len(sizes),
+                                [noise] * len(sizes), seeds))
+    quantiles = [(1 - level) / 2 * 100, (1 + level) / 2 * 100]
+    for i, column in enumerate(["simple_efficiency_gap", "modified_efficiency_gap"]):
+        gaps = np.concatenate([batch[i] for batch in batches])
+        point[column + "_low"], point[column + "_high"] = np.nanpercentile(gaps, quantiles, axis=0)
+        point[column + "_sd"] = np.nanstd(gaps, axis=0)
+    return point
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input", nargs="?", default="output_with_incumbency.csv")
+    arg_parser.add_argument("--output", default="filtered_intervals.csv")
+    arg_parser.add_argument("--draws", type=int, default=10000)
+    arg_parser.add_argument("--method", choices=["noise", "bootstrap"], default="noise")
+    arg_parser.add_argument("--noise", type=float, default=.05,
+                            help="standard deviation of the relative error on each vote count")
+    arg_parser.add_argument("--level", type=float, default=.95)
+    arg_parser.add_argument("--batch-size", type=int, default=200)
+    arg_parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    intervals = gap_intervals(pd.read_csv(args.input, keep_default_na=False, na_values=[""]), args.draws,
+                              args.method, args.noise, args.level, args.batch_size, args.workers, args.seed)
+    intervals.index += 1  # the same row names as filtered.csv
+    intervals.to_csv(args.output)
@@ -1,35 +1,147 @@
+from candidate_identity import IdentityIndex, assign_person_ids
+from columnar import is_arrow_path, read_table, write_table
+from election_store import ElectionStore
+import argparse
+import hashlib
+import json
+import os
 import pandas as pd
 import string
-data = pd.read_csv("output.csv")
-incumbents = {}
-adding_now = {}
-output = []
+
 punc_translator = str.maketrans('', '', string.punctuation)
 space_translator = str.maketrans('', '', string.whitespace)
 
-for i in range(1, 40):
-    for index, row in data[data["congress"] == i].iterrows():
-        name_processed = str(row["name"]).translate(punc_translator)
-        name_processed = name_processed.translate(space_translator)
-        data_tuple = (
-            row["state"],
-            row["district"],
-            name_processed,
-        )
-
-        if data_tuple in incumbents:
-            row["incumbent"] = True
-            row["old_vote_share"] = incumbents[data_tuple]
-            row["clean_name"] = name_processed
+base_key_columns = ["congress", "state", "district", "clean_name"]
+derived_columns = ["incumbent", "old_vote_share", "clean_name", "person_id"]
+
+
+def incumbency_key_columns(index=None):
+    return base_key_columns[:-1] + ["person_id"] if index is not None else base_key_columns
+
+
+def shifted_winners(data, key_columns):
+    # each seat's winners, keyed by the congress in which they are incumbents
+    winners = data.loc[data["result"] == "won", key_columns + ["percentage"]]
+    winners = winners.drop_duplicates(key_columns, keep="last")
+    return winners.assign(congress=winners["congress"] + 1).rename(columns={"percentage": "old_vote_share"})
+
+
+def compute_incumbency(data, index=None, carried_winners=None):
+    # a candidate is an incumbent if they won the same seat in the previous congress. Given an
+    # IdentityIndex, candidates are matched by person_id, which tolerates OCR variants of a name.
+    # carried_winners are the shifted_winners of the congress before data starts, if it is not in data
+    data = data[(data["congress"] >= 1).fillna(False)].sort_values("congress", kind="stable")
+    data = data.assign(clean_name=data["name"].fillna("nan").astype(str).str.translate(punc_translator)
+                       .str.translate(space_translator))
+    key_columns = incumbency_key_columns(index)
+    if index is not None:
+        data = assign_person_ids(data, index)
+    winners = shifted_winners(data, key_columns)
+    if carried_winners is not None:
+        winners = pd.concat([carried_winners[key_columns + ["old_vote_share"]], winners])
+    merged = data[key_columns].merge(winners, how="left", on=key_columns, indicator=True)
+    output = data.drop(columns=["clean_name", "person_id"], errors="ignore")
+    output["incumbent"] = (merged["_merge"] == "both").to_numpy()
+    output["old_vote_share"] = merged["old_vote_share"].to_numpy()
+    output["clean_name"] = data["clean_name"]
+    if index is not None:
+        output["person_id"] = data["person_id"]
+    return output
+
+
+def congress_hashes(data):
+    columns = [column for column in data.columns if column not in derived_columns]
+    return {int(congress): hashlib.sha1(pd.util.hash_pandas_object(rows[columns].astype(str), index=False)
+                                        .to_numpy().tobytes()).hexdigest()
+            for congress, rows in data.groupby("congress")}
+
+
+def update_incumbency(data, output_path, state_path, index=None):
+    # data holds the rows of whichever congresses were (re)parsed. Congresses whose rows are unchanged
+    # since the last run are skipped. An edit to congress k can only change the incumbents of k and
+    # k + 1, so only those are recomputed; congresses after the last one are appended to the output
+    # using the winners saved in state_path, without reading the output back. Rows keep the index
+    # they have in data, as in compute_incumbency, so data should be indexed like output.csv.
+    # The saved winners are keyed by clean_name or, with an IdentityIndex, by person_id; if that
+    # differs from the last run, every congress is recomputed. Returns the new rows.
+    key_columns = incumbency_key_columns(index)
+    state = {"congresses": {}, "winners": [], "key_columns": key_columns, "rows": 0}
+    if os.path.exists(state_path) and os.path.exists(output_path):
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+    rekey = state.get("key_columns") != key_columns or "rows" not in state
+    data = data[(data["congress"] >= 1).fillna(False)]
+    hashes = congress_hashes(data)
+    changed = sorted(congress for congress, digest in hashes.items()
+                     if state["congresses"].get(str(congress)) != digest)
+    if not changed and not rekey:
+        return data.iloc[:0]
+    known = {int(congress) for congress in state["congresses"]}
+    last = max(known, default=0)
+    if not rekey and changed[0] > last and state["rows"]:
+        carried = pd.DataFrame(state["winners"]) if changed[0] == last + 1 and state["winners"] else None
+        output = compute_incumbency(data[data["congress"].isin(changed)], index, carried)
+        output.to_csv(output_path, mode="a", header=False)
+        total = state["rows"] + len(output)
+    else:
+        # read back as written: a nameless candidate's clean_name is the string "nan"
+        previous = pd.read_csv(output_path, index_col=0, keep_default_na=False, na_values=[""]) if known \
+            else data.iloc[:0]
+        if rekey:
+            affected = known | set(hashes)
         else:
-            row["incumbent"] = False
-            row["old_vote_share"] = None
-            row["clean_name"] = name_processed
-
-        if row["result"] == "won":
-            adding_now[data_tuple] = row["percentage"]
-        output.append(row)
-    incumbents = adding_now
-    adding_now = {}
-output = pd.DataFrame(output)
-output.to_csv("output_with_incumbency.csv")
+            affected = set(changed) | {congress + 1 for congress in changed if congress + 1 in known | set(hashes)}
+        sources = [data[data["congress"] == congress] if congress in hashes else
+                   previous[previous["congress"] == congress].drop(columns=derived_columns, errors="ignore")
+                   for congress in sorted(affected | {congress - 1 for congress in affected})]
+        output = compute_incumbency(pd.concat(sources), index)
+        output = output[output["congress"].isin(affected)]
+        # after a change of key columns, previous may still have a person_id column that output has not
+        full = pd.concat([previous[~previous["congress"].isin(affected)], output])[list(output.columns)]
+        full = full.sort_values("congress", kind="stable")
+        full.to_csv(output_path)
+        total = len(full)
+        output = full[full["congress"].isin(affected)]
+    state["congresses"].update({str(congress): digest for congress, digest in hashes.items()})
+    state["rows"] = total
+    state["key_columns"] = key_columns
+    last = max(int(congress) for congress in state["congresses"])
+    if output["congress"].eq(last).any():
+        state["winners"] = shifted_winners(output[output["congress"] == last], key_columns).to_dict("records")
+    with open(state_path, "w") as state_file:
+        json.dump(state, state_file)
+    return output
+
+
+def read_elections(path, columns=None):
+    if is_arrow_path(path) or str(path).endswith(".parquet"):
+        return read_table(path, columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input", nargs="?", default="output.csv", help="parser output, as csv, Parquet or Arrow")
+    arg_parser.add_argument("--output", default="output_with_incumbency.csv")
+    arg_parser.add_argument("--columnar", help="also write the result to a typed Parquet (or .arrow) file")
+    arg_parser.add_argument("--sqlite", help="also load the result into this SQLite election database")
+    arg_parser.add_argument("--identities", help="match candidates fuzzily, keeping their person ids in this JSON file")
+    arg_parser.add_argument("--incremental", metavar="STATE",
+                            help="update --output in place with only the new or changed congresses in the input, "
+                                 "keeping per-congress hashes and the last winners in this JSON file")
+    args = arg_parser.parse_args()
+    index = None
+    if args.identities:
+        index = IdentityIndex.load(args.identities) if os.path.exists(args.identities) else IdentityIndex()
+    if args.incremental:
+        output = update_incumbency(read_elections(args.input), args.output, args.incremental, index)
+    else:
+        output = compute_incumbency(read_elections(args.input), index)
+        output.to_csv(args.output)
+    if index is not None:
+        index.save(args.identities)
+    if args.columnar:
+        write_table(read_elections(args.output).iloc[:, 1:] if args.incremental else output, args.columnar)
+    if args.sqlite:
+        with ElectionStore(args.sqlite) as store:
+            store.load(output.to_dict("records"))
@@ -0,0 +1,74 @@
+from collections import Counter, defaultdict
+import functools
+import json
+import time
+import warnings
+
+
+def format_problem(message, details):
+    if not details:
+        return message
+    return message + "\n" + "".join(str(detail) for detail in details)
+
+
+class Instrumentation:
+    # call counts and cumulative time per instrumented function, plus a count of each kind of
+    # parse problem. Problem details are kept as objects and only turned into text for the report.
+    # Blocks read from the parse cache are not timed, so they are counted as cache hits instead.
+    def __init__(self, max_examples=5):
+        self.max_examples = max_examples
+        self.emit_warnings = False
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.problems = Counter()
+        self.cache = Counter()
+        self.examples = defaultdict(list)
+
+    def timed(self, function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.calls[name] += 1
+                self.seconds[name] += time.perf_counter() - start
+        return wrapper
+
+    def problem(self, category, message, *details):
+        self.problems[category] += 1
+        examples = self.examples[category]
+        if len(examples) < self.max_examples:
+            examples.append((message, details))
+        if self.emit_warnings:
+            warnings.warn(format_problem(message, details))
+
+    def as_dict(self):
+        return {
+            "functions": {name: {"calls": self.calls[name], "seconds": self.seconds[name]}
+                          for name in sorted(self.calls)},
+            "problems": dict(sorted(self.problems.items())),
+            "cache": dict(sorted(self.cache.items())),
+            "examples": {category: [format_problem(message, details) for message, details in examples]
+                         for category, examples in sorted(self.examples.items())}
+        }
+
+    def merge(self, report):
+        # folds in the as_dict() of another run, e.g. one from a worker process
+        for name, function in report["functions"].items():
+            self.calls[name] += function["calls"]
+            self.seconds[name] += function["seconds"]
+        self.problems.update(report["problems"])
+        self.cache.update(report.get("cache", {}))
+        for category, examples in report["examples"].items():
+            room = self.max_examples - len(self.examples[category])
+            self.examples[category] += [(example, ()) for example in examples[:max(room, 0)]]
+
+    def write_report(self, path):
+        with open(path, "w") as report_file:
+            json.dump(self.as_dict(), report_file, indent=2)
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ParseCache:
+    # rows parsed from each congress block, with the problem counts of its parse, stored as one
+    # JSON file per block hash. Entries are namespaced by the parser version, so any change to the
+    # parser starts from an empty cache.
+    def __init__(self, directory, version, max_entries=1000):
+        self.directory = os.path.join(directory, version)
+        self.max_entries = max_entries
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_stale_versions(directory, version)
+
+    @staticmethod
+    def remove_stale_versions(directory, version):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name != version and os.path.isdir(path):
+                for entry in os.listdir(path):
+                    remove_quietly(os.path.join(path, entry))
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as cache_file:
+                rows = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # eviction drops the least recently used entries first
+        return rows
+
+    def put(self, key, rows):
+        # written to a temporary file first so parallel workers never read a half-written entry
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as cache_file:
+            json.dump(rows, cache_file)
+        os.replace(temp_path, self.path(key))
+
+    def prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            remove_quietly(path)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def block_key(congress, spans):
+    hasher = hashlib.sha1(congress.encode())
+    for span in spans:
+        hasher.update(repr(span).encode())
+    return hasher.hexdigest()
+
+
+def source_version(*paths):
+    hasher = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as source:
+            hasher.update(source.read())
+    return hasher.hexdigest()[:16]
@@ -1,20 +1,175 @@
-from bs4 import BeautifulSoup
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import csv
+import io
+import os
+import re
 import string
-soup = BeautifulSoup(open("vote_record.html"))
-writer = csv.writer(open("vote_record.csv", "w"))
 
 punc_translator = str.maketrans('', '', string.punctuation)
 space_translator = str.maketrans('', '', string.whitespace)
 
+# the House Journal lists the members voting on each side of a roll call as a pair of lists,
+# introduced by "those who voted in the affirmative" and "in the negative". A list without that text
+# is only taken as a roll call when it sits right next to a list whose side is known, or when it and
+# the list after it open the page, as the yeas and nays do in vote_record.html. Other lists on a
+# page (bills, petitions) are skipped.
+side_cues = [re.compile("(affirmative)|(negative)", re.IGNORECASE),
+             re.compile("\\b(yeas)\\b|\\b(nays)\\b", re.IGNORECASE)]
+list_tags = ("ul", "ol")
+fieldnames = ["vote_id", "clean_name", "vote"]
 
-writer.writerow(["clean_name", "vote"])
-results = list(soup.find_all("ul"))
-for yes in results[0].find_all("li"):
-    name_processed = yes.text.translate(punc_translator)
-    name_processed = name_processed.translate(space_translator)
-    writer.writerow([name_processed, "yes"])
-for no in results[1].find_all("li"):
-    name_processed = no.text.translate(punc_translator)
-    name_processed = name_processed.translate(space_translator)
-    writer.writerow([name_processed, "no"])
\ No newline at end of file
+# a list on the page: its side from the text before it (None if the text does not say), whether
+# only whitespace separates it from the list before, and whether it is the first thing on the page
+VoteList = namedtuple("VoteList", ["members", "side", "adjacent", "opening"])
+
+
+def clean_name(name):
+    return name.translate(punc_translator).translate(space_translator)
+
+
+def list_side(cue):
+    # the last mention of a side before the list wins, e.g. "the yeas and nays being taken, those who
+    # voted in the negative are"; None when the text does not say
+    for regex in side_cues:
+        matches = list(regex.finditer(cue))
+        if matches:
+            return "yes" if matches[-1].group(1) else "no"
+    return None
+
+
+def other_side(side):
+    return "no" if side == "yes" else "yes"
+
+
+def list_layout(element, texts):
+    # texts holds the text of the elements before, which have already been cleared
+    previous = element.getprevious()
+    if previous is None:
+        cue = element.getparent().text or ""
+    else:
+        cue = texts.get(previous, "") + (previous.tail or "")
+    adjacent = previous is not None and previous.tag in list_tags and not cue.strip()
+    opening = previous is None and element.getparent().tag == "body" and not cue.strip()
+    return list_side(cue), adjacent, opening
+
+
+def list_sides(lists):
+    sides = []
+    open_side = None  # the side of the list before, while it still lacks the other side of its pair
+    for i, vote_list in enumerate(lists):
+        side = vote_list.side
+        following = lists[i + 1] if i + 1 < len(lists) and lists[i + 1].adjacent else None
+        completes = vote_list.adjacent and open_side is not None
+        if side is None:
+            if completes:
+                side = other_side(open_side)
+            elif following is not None and following.side is not None:
+                side = other_side(following.side)
+            elif vote_list.opening and following is not None:
+                side = "yes"
+        sides.append(side)
+        open_side = None if completes else side
+    return sides
+
+
+def roll_call_rows(source, name):
+    # source is a path or an open binary file; votes are numbered name-1, name-2, ... in page order.
+    # Elements are dropped as soon as they have been read, as in parser.stream_spans.
+    from lxml import etree
+    lists = []
+    texts = {}
+    layout = None
+    members = []
+    depth = 0  # of the lists open
+    for event, element in etree.iterparse(source, events=("start", "end"), html=True):
+        if event == "start":
+            if element.tag in list_tags:
+                if not depth:
+                    layout = list_layout(element, texts)
+                depth += 1
+            continue
+        if element.tag in list_tags:
+            depth -= 1
+            if not depth:
+                lists.append(VoteList(members, *layout))
+                members = []
+                texts[element] = ""
+        elif depth:
+            if element.tag == "li":
+                members.append(clean_name("".join(element.itertext())))
+                element.clear(keep_tail=True)
+            continue
+        else:
+            texts[element] = (element.text or "") + "".join(texts.pop(child, "") + (child.tail or "")
+                                                            for child in element)
+        element.clear(keep_tail=True)
+        parent = element.getparent()  # None for the root, whose siblings are comments
+        while parent is not None and element.getprevious() is not None:
+            texts.pop(element.getprevious(), None)
+            del parent[0]
+    rows = []
+    vote_number = 0
+    sides = set()  # the sides already listed for the current vote
+    for vote_list, side in zip(lists, list_sides(lists)):
+        if side is None:
+            continue
+        if side in sides or not vote_number:
+            vote_number += 1
+            sides = set()
+        sides.add(side)
+        rows += [("%s-%d" % (name, vote_number), member, side) for member in vote_list.members]
+    return rows
+
+
+def parse_roll_call(html, name="vote"):
+    # html is one page, as str or bytes
+    return roll_call_rows(io.BytesIO(html.encode() if isinstance(html, str) else html), name)
+
+
+def journal_files(paths):
+    # every HTML file named, or found in a directory named
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                if entry.endswith((".htm", ".html")):
+                    yield os.path.join(path, entry)
+        else:
+            yield path
+
+
+def parse_journal_file(path):
+    return roll_call_rows(path, os.path.splitext(os.path.basename(path))[0])
+
+
+def parse_journals(paths, workers=None):
+    files = list(journal_files(paths))
+    if len(files) == 1 or workers == 1:
+        return [row for path in files for row in parse_journal_file(path)]
+    with ProcessPoolExecutor(workers) as pool:
+        return [row for rows in pool.map(parse_journal_file, files, chunksize=16) for row in rows]
+
+
+def write_roll_call(rows, path):
+    with open(path, "w") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("inputs", nargs="*", default=["vote_record.html"],
+                            help="House Journal pages, or directories of them")
+    arg_parser.add_argument("--output", default="vote_record.csv")
+    arg_parser.add_argument("--columnar", help="also write the votes to a typed Parquet (or .arrow) file")
+    arg_parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    args = arg_parser.parse_args()
+    rows = parse_journals(args.inputs, args.workers)
+    write_roll_call(rows, args.output)
+    if args.columnar:
+        # pandas is only needed for the columnar output, so it is not imported otherwise
+        import pandas as pd
+        from columnar import write_table
+        write_table(pd.DataFrame(rows, columns=fieldnames), args.columnar)
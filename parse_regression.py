@@ -0,0 +1,149 @@
+from collections import Counter, defaultdict
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# compares the rows two parser versions produce for the same pages. Rows are grouped by election
+# in a dict, so every election and every candidate is looked at once.
+
+election_columns = ["congress", "state", "district", "trial"]
+candidate_columns = ["party", "votes", "percentage", "result", "runoff", "type", "year", "election_dates",
+                     "num_elected"]
+
+
+def name_key(name):
+    return "".join(name.split())
+
+
+def read_elections(path):
+    # election key -> candidate name -> the candidate's rows (a name can appear twice in a race)
+    elections = defaultdict(lambda: defaultdict(list))
+    with open(path, newline="") as rows_file:
+        for row in csv.DictReader(rows_file):
+            key = tuple(row[column] for column in election_columns)
+            elections[key][name_key(row["name"])].append(tuple(row[column] for column in candidate_columns))
+    return elections
+
+
+def compare_elections(old, new):
+    report = {"elections_added": [], "elections_removed": [], "elections_changed": []}
+    for key in old.keys() | new.keys():
+        if key not in new:
+            report["elections_removed"].append(key)
+            continue
+        if key not in old:
+            report["elections_added"].append(key)
+            continue
+        before, after = old[key], new[key]
+        added = Counter({name: len(rows) for name, rows in after.items()}) - \
+            Counter({name: len(rows) for name, rows in before.items()})
+        removed = Counter({name: len(rows) for name, rows in before.items()}) - \
+            Counter({name: len(rows) for name, rows in after.items()})
+        changed = {}
+        for name in before.keys() & after.keys():
+            for old_row, new_row in zip(before[name], after[name]):
+                if old_row != new_row:
+                    changed[name] = {column: [a, b] for column, a, b in zip(candidate_columns, old_row, new_row)
+                                     if a != b}
+        if added or removed or changed:
+            report["elections_changed"].append({"election": dict(zip(election_columns, key)),
+                                                "added": sorted(added.elements()),
+                                                "removed": sorted(removed.elements()),
+                                                "changed": changed})
+    for name in report:
+        report[name].sort(key=lambda item: str(item.get("election") if isinstance(item, dict) else item))
+    return report
+
+
+def count_changes(report):
+    candidates = Counter()
+    for election in report["elections_changed"]:
+        candidates["added"] += len(election["added"])
+        candidates["removed"] += len(election["removed"])
+        candidates["changed"] += len(election["changed"])
+    return {"elections added": len(report["elections_added"]),
+            "elections removed": len(report["elections_removed"]),
+            "elections changed": len(report["elections_changed"]),
+            "candidates added": candidates["added"],
+            "candidates removed": candidates["removed"],
+            "candidates changed": candidates["changed"]}
+
+
+def print_report(report, limit=20):
+    for name, count in count_changes(report).items():
+        print("%-20s %6d" % (name, count))
+    for name, label in (("elections_removed", "removed"), ("elections_added", "added")):
+        for key in report[name][:limit]:
+            print("%s election: %s" % (label, ", ".join(map(str, key))))
+    for election in report["elections_changed"][:limit]:
+        print(", ".join(str(value) for value in election["election"].values()))
+        for name in election["removed"]:
+            print("  - " + name)
+        for name in election["added"]:
+            print("  + " + name)
+        for name, columns in election["changed"].items():
+            print("  ~ %s %s" % (name, " ".join("%s: %s -> %s" % (column, *values) for column, values in columns.items())))
+
+
+def parse_at_revision(revision, inputs, output):
+    # runs the parser as it was at a git revision, from a scratch copy of that revision's files.
+    # Before it took --output, the parser read 1-150.html and wrote output.csv, so each page is then
+    # copied to 1-150.html and parsed on its own, and the outputs are joined in page order.
+    repository = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        archive = subprocess.run(["git", "archive", revision], cwd=repository, check=True,
+                                 stdout=subprocess.PIPE).stdout
+        subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+        with open(os.path.join(directory, "parser.py")) as parser_file:
+            takes_output = "--output" in parser_file.read()
+        if takes_output:
+            subprocess.run([sys.executable, "parser.py", *map(os.path.abspath, inputs), "--output",
+                            os.path.abspath(output)], cwd=directory, check=True, stdout=subprocess.DEVNULL)
+            return
+        with open(output, "w", newline="") as output_file:
+            writer = csv.writer(output_file)
+            for n, path in enumerate(inputs):
+                shutil.copyfile(path, os.path.join(directory, "1-150.html"))
+                # the old parser raises a warning for every parse problem
+                subprocess.run([sys.executable, "-W", "ignore", "parser.py"], cwd=directory, check=True,
+                               stdout=subprocess.DEVNULL)
+                with open(os.path.join(directory, "output.csv"), newline="") as page_file:
+                    rows = csv.reader(page_file)
+                    header = next(rows)
+                    if n == 0:
+                        writer.writerow(header)
+                    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("old", help="parser output to compare against, or a git revision with --revision")
+    arg_parser.add_argument("new", nargs="*", help="parser output to check, or the HTML pages with --revision")
+    arg_parser.add_argument("--revision", action="store_true",
+                            help="parse the pages with the parser at revision OLD and with the working tree")
+    arg_parser.add_argument("--json", help="write the full report to this file")
+    arg_parser.add_argument("--limit", type=int, default=20, help="number of elections to print of each kind")
+    arg_parser.add_argument("--allow", type=int, default=0,
+                            help="number of changed elections to accept before exiting with an error")
+    args = arg_parser.parse_args()
+    if args.revision:
+        with tempfile.TemporaryDirectory() as scratch:
+            old_path, new_path = os.path.join(scratch, "old.csv"), os.path.join(scratch, "new.csv")
+            parse_at_revision(args.old, args.new, old_path)
+            subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser.py"),
+                            *args.new, "--output", new_path], check=True, stdout=subprocess.DEVNULL)
+            report = compare_elections(read_elections(old_path), read_elections(new_path))
+    else:
+        report = compare_elections(read_elections(args.old), read_elections(args.new[0]))
+    print_report(report, args.limit)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    counts = count_changes(report)
+    if counts["elections added"] + counts["elections removed"] + counts["elections changed"] > args.allow:
+        sys.exit(1)
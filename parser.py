@@ -1,11 +1,14 @@
-from bs4 import BeautifulSoup
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import Instrumentation
+from flatten_table import flatten_tables
+from parse_cache import ParseCache, block_key, source_version
+from sinks import ColumnarSink, CsvSink, SqliteSink, write_rows
+import argparse
+import io
 import re
-import warnings
-import csv
 import string
-soup = BeautifulSoup(open("1-150.html"), "lxml")
-for e in soup.findAll('br'): # removing pesky linebreaks
-    e.extract()
+import sys
 
 
 congress_re = re.compile("([0-9]+)(th|st|rd|nd)\s+Congress")
@@ -18,8 +21,6 @@ only_numbers = re.compile("[0-9]+")
 party_i_regex = re.compile("\(([A-z\-\s,/]+)\)")
 
 
-candidate_completeness_regex_1 = re.compile("[0-9\"']?\"?\*")
-candidate_completeness_regex_2 = re.compile("[0-9\"']?(\*)?[A-z]+")
 candidate_completeness_regex_3 = re.compile("[0-9\"']?(\*)?([A-z\s.]+)\s*\(([A-z\-\s,/]+)\)")
 candidate_completeness_regex_4 = re.compile("[0-9\"']?(\*)?([A-z\s.]+)(\s*\(([A-z\-\s,/]+)\))?\s+[\(\[]?([0-9,]+)[\)\]]?")
 candidate_completeness_regex_5 = re.compile(
@@ -29,8 +30,20 @@ letters = re.compile("[A-z]")
 
 candidate_completeness_regex_2_everything = re.compile("(\*)?([A-z|\s|.]+)")
 
+completeness_regexes = {
+    3: candidate_completeness_regex_3,
+    4: candidate_completeness_regex_4,
+    5: candidate_completeness_regex_5
+}
+completeness_prefilters = {
+    3: re.compile("\([A-z\-\s,/]+\)"),
+    4: re.compile("\s[\(\[]?[0-9,]"),
+    5: re.compile("[0-9,]\)?\s+[\(\[][0-9.]+[\)|\]]")
+}
+
 punc_translator = str.maketrans('', '', string.punctuation)
 space_translator = str.maketrans('', '', string.whitespace)
+ascii_space_translator = str.maketrans('', '', ' \n\t\f\r')
 
 word_to_num = {
     "one": 1,
@@ -66,11 +79,20 @@ states = {
     "Washington", "WestVirginia", "Wisconsin", "Wyoming"
 }
 
+# one alternation over every state name, grouped by first letter so each position of the text is
+# only tried against the states starting with that letter
+state_name_regex = re.compile("|".join(
+    "%s(?:%s)" % (initial, "|".join(re.escape(state[1:]) for state in sorted(states, key=len, reverse=True)
+                                   if state[0] == initial))
+    for initial in sorted({state[0] for state in states})))
+shortest_state_name = min(len(state) for state in states)
+
+
+instrumentation = Instrumentation()
+
+fieldnames = ["congress", "type", "year", "election_dates", "state", "district", "runoff", "trial", "num_elected",
+              "name", "party", "votes", "percentage", "result"]
 
-writer = csv.DictWriter(open("output.csv", "w"), ["congress", "type", "year", "election_dates", "state", "district",
-                                                  "runoff", "trial", "num_elected", "name", "party", "votes",
-                                                  "percentage", "result"])
-writer.writeheader()
 
 def is_valid_span(span):
     if span.name == "span":
@@ -83,272 +105,370 @@ def is_valid_span(span):
     return False
 
 
-def is_congress(span):
-    try:
-        return span.parent.parent["size"] == "6"
-    except KeyError:
-        try:
-            return span.parent["size"] == "6"
-        except KeyError:
-            return False
+CONGRESS = 1
+SUBHEADER = 2
+YEAR = 4
+STATE = 8
+TRIAL = 16
+DISTRICT = 32
 
 
-def is_subheader(span):
-    try:
-        return span.parent.parent["size"] == "5"
-    except KeyError:
-        try:
-            return span.parent["size"] == "5"
-        except KeyError:
-            return False
+class Span(namedtuple("Span", ["kind", "size", "style", "text", "italic_text", "bold_text"])):
+    # every span of the volume is held at once, so only the text is stored; the flattened forms
+    # are only read for a few kinds of span and are derived when needed
+    __slots__ = ()
 
+    @property
+    def flat_text(self):
+        return get_flat_text(self.text)
 
-def is_year(span):
-    try:
-        return span.parent.parent["size"] == "3" or span.parent.parent["size"] == "4"
-    except KeyError:
-        try:
-            return span.parent["size"] == "3" or span.parent["size"] == "4"
-        except KeyError:
-            return False
+    @property
+    def state_text(self):
+        return get_state_text(self.text)
 
 
-def does_not_have_i_children(span):
-    for tag in span.find_all():
-        if tag.name == "i":
-            if not party_i_regex.match(tag.text.strip()):
-                return False
-            else:
-                print("Detected: ", tag.text)
+class Row(namedtuple("Row", fieldnames)):
+    # one row of output.csv; a tuple of shared, interned values rather than a dict per candidate
+    __slots__ = ()
+
+    def get(self, field, default=None):
+        # so rows can be read like the records pandas produces, e.g. by SqliteSink
+        return getattr(self, field, default)
+
+# what is known about the election so far on the way down the parse hierarchy; unset fields are written as ""
+Context = namedtuple("Context", ["congress", "type", "year", "election_dates", "state", "district", "trial",
+                                 "num_elected"], defaults=[""] * 8)
+
+
+def does_not_have_i_children(i_texts):
+    for text in i_texts:
+        if not party_i_regex.match(text.strip()):
+            return False
+        instrumentation.problem("party in italics", "Detected: ", text)
     return True
 
 
-def contains_state_name(span):
-    text = get_state_text(span)
-    for state in states:
-        if state in text:
-            return True
-    return False
+def contains_state_name(text):
+    return len(text) >= shortest_state_name and state_name_regex.search(text) is not None
 
-def get_state_text(span):
-    info = " ".join(span.text.split()).strip(" ")
+
+def get_state_text(text):
+    info = " ".join(text.split()).strip(" ")
     return info
 
-def is_state(span):
-    try:
-        parent = span.parent.parent
-        size = parent["size"]
-    except KeyError:
-        try:
-            parent = span.parent
-            size = parent["size"]
-        except KeyError:
-            return False
-    if size == "2":
-        return does_not_have_i_children(span) and contains_state_name(span)
-    elif size == "1":
-        try:
-            style = parent["style"]
-        except KeyError:
-            return False
-        if style == "font-size: 8pt" or style== "font-size: 9pt":
-            return does_not_have_i_children(span) and contains_state_name(span)
-        else:
-            return False
-    else:
-        return False
+
+def get_flat_text(text):
+    info = "".join(text.split())
+    return info
 
 
-def is_trial(span):
+def classify_span(span):
     try:
-        parent = span.parent.parent
-        size = parent["size"]
+        font = span.parent.parent
+        size = font["size"]
     except KeyError:
         try:
-            parent = span.parent
-            size = parent["size"]
+            font = span.parent
+            size = font["size"]
         except KeyError:
-            return False
-    if size == "2":
-        return does_not_have_i_children(span) and "Trial" in span.text
-    elif size == "1":
-        try:
-            style = parent["style"]
-        except KeyError:
-            return False
-        if style == "font-size: 8pt":
-            return does_not_have_i_children(span) and "Trial" in span.text
-        else:
-            return False
+            font = None
+            size = None
+    style = font.get("style") if font is not None else None
+    bold = span.find("b")
+    return make_span(span.text, size, style, [tag.text for tag in span.find_all("i")],
+                     bold.text if bold is not None else None)
+
+
+def classify_element(element):
+    font = element.getparent().getparent()
+    if font is None or "size" not in font.attrib:
+        font = element.getparent()
+        if "size" not in font.attrib:
+            font = None
+    size = font.get("size") if font is not None else None
+    style = font.get("style") if font is not None else None
+    bold = element.find(".//b")
+    return make_span(get_element_text(element), size, style, [get_element_text(tag) for tag in element.iter("i")],
+                     get_element_text(bold) if bold is not None else None)
+
+
+def get_element_text(element):
+    # BeautifulSoup collapses whitespace-only strings to a single newline or space, so do the same here
+    pieces = []
+    for piece in element.itertext():
+        if piece and not piece.translate(ascii_space_translator):
+            piece = "\n" if "\n" in piece else " "
+        pieces.append(piece)
+    return "".join(pieces)
+
+
+def make_span(text, size, style, i_texts, bold_text):
+    kind = 0
+    if i_texts:
+        kind |= DISTRICT
+    if size == "6":
+        kind |= CONGRESS
+    elif size == "5":
+        kind |= SUBHEADER
+    elif size == "3" or size == "4":
+        kind |= YEAR
+    elif size == "2" or (size == "1" and style in ("font-size: 8pt", "font-size: 9pt")):
+        if does_not_have_i_children(i_texts):
+            if contains_state_name(get_state_text(text)):
+                kind |= STATE
+            if "Trial" in text and (size == "2" or style == "font-size: 8pt"):
+                kind |= TRIAL
+    # attribute values are separate strings for every tag, but only a handful are distinct
+    return Span(kind, intern_text(size), intern_text(style), text, i_texts[0] if i_texts else None, bold_text)
+
+
+def intern_text(value):
+    return sys.intern(value) if value is not None else None
+
+
+def soup_spans(source, flatten=False):
+    # bs4 and lxml are only imported once HTML is read, so importing the parser stays cheap
+    from bs4 import BeautifulSoup
+    if isinstance(source, (bytes, bytearray)):
+        soup = BeautifulSoup(source, "lxml")
     else:
-        return False
-
-
-def is_district(span):
-    for tag in span.find_all():
-        if tag.name == "i":
-            return True
-    return False
+        with open(source) as html_file:
+            soup = BeautifulSoup(html_file, "lxml")
+    if flatten:
+        flatten_tables(soup)
+    for e in soup.find_all('br'):  # removing pesky linebreaks
+        e.extract()
+    return [classify_span(span) for span in soup.find_all(is_valid_span)]
+
+
+def stream_spans(source):
+    # same spans as soup_spans, but elements are dropped as soon as they have been read
+    from lxml import etree
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    open_spans = []
+    for event, element in etree.iterparse(source, events=("start", "end"), html=True, encoding="utf-8"):
+        if event == "start":
+            if element.tag not in ("b", "i", "img", "br"):
+                for open_span in open_spans:
+                    open_span[1] = False
+            if element.tag == "span":
+                open_spans.append([element, True])
+            continue
+        if element.tag == "span":
+            valid = open_spans.pop()[1]
+            if valid:
+                yield classify_element(element)
+        if not open_spans:
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
 
 def parse_congress(congress_span):
     try:
-        name = congress_span.find("b").text
+        name = congress_span.bold_text
         result = congress_re.search(name)
         if result:
             return result.group(1)
         else:
-            warnings.warn("Congress not successfully parsed." + "\n" + name)
-    except AttributeError:
-        warnings.warn("Congress not successfully parsed." + "\n" + str(congress_span))
+            instrumentation.problem("congress not parsed", "Congress not successfully parsed.", name)
+    except TypeError:
+        instrumentation.problem("congress not parsed", "Congress not successfully parsed.", congress_span.text)
+
+
+@instrumentation.timed
+def parse_out_congress(all_spans, rows, cache=None):
+    for congress, block, start in congress_blocks(all_spans):
+        if cache is None:
+            parse_subheadings(block, start, len(block), Context(congress=congress), rows)
+            continue
+        key = block_key(congress, block[start:])
+        block_rows = cached_block(cache, key)
+        if block_rows is None:
+            block_rows, problems = parse_block(congress, block, start)
+            cache.put(key, {"rows": block_rows, "problems": problems})
+        rows.extend(block_rows)
 
 
-def parse_out_congress(soup):
-    all_spans = soup.find_all(is_valid_span)
-    index = -1
+def congress_blocks(all_spans):
+    block = []
     current_congress = ""
-    for i, span in enumerate(all_spans):
-        if is_congress(span):
+    found = False
+    for span in all_spans:
+        if span.kind & CONGRESS:
             result = parse_congress(span)
             if result:
-                if index != -1:
-                    parse_subheadings(all_spans[index + 1:i], {"congress": current_congress})
+                if found:
+                    yield current_congress, block, 1
+                elif block:
+                    instrumentation.problem("spans before first congress",
+                                            "Spans before the first congress header were not parsed: ", len(block))
                 current_congress = result
-                index = i
-    parse_subheadings(all_spans[index:], {"congress": current_congress})
-
-
-def parse_subheadings(congress, data_so_far):
+                found = True
+                block = []
+        block.append(span)
+    yield current_congress, block, 0 if found else max(len(block) - 1, 0)
+
+
+def parse_block(congress, block, start):
+    # the rows of one congress block and the problems counted while parsing it
+    before = instrumentation.problems.copy()
+    rows = []
+    parse_subheadings(block, start, len(block), Context(congress=congress), rows)
+    return rows, dict(instrumentation.problems - before)
+
+
+def cached_block(cache, key):
+    # a cached block counts the problems its parse ran into again, so a report from a cached run
+    # has the same problem counts as one from an uncached run
+    entry = cache.get(key)
+    if entry is None:
+        instrumentation.cache["misses"] += 1
+        return None
+    instrumentation.cache["hits"] += 1
+    instrumentation.problems.update(entry["problems"])
+    return [Row(*row) for row in entry["rows"]]
+
+
+@instrumentation.timed
+def parse_subheadings(spans, start, stop, context, rows):
     current_heading = "StandardElections"
-    index = -1
-    for i, span in enumerate(congress):
-        if is_subheader(span):
+    index = start - 1
+    for i in range(start, stop):
+        span = spans[i]
+        if span.kind & SUBHEADER:
             subheader = parse_out_subheadings(span)
             if subheader:
-                new_data = {**data_so_far, **{"type": current_heading}}
+                new_context = context._replace(type=current_heading)
                 if current_heading == "StandardElections":
-                    parse_ordinary_years(congress[index + 1:i], {**new_data, **{"trial": 1}})
+                    parse_ordinary_years(spans, index + 1, i, new_context._replace(trial=1), rows)
                 if current_heading == "RunoffElections":
-                    parse_runoff_states(congress[index + 1:i], new_data)
+                    parse_runoff_states(spans, index + 1, i, new_context, rows)
                 index = i
                 current_heading = subheader
                 # do some parsing
             else:
                 continue
     if current_heading == "StandardElections":
-        parse_ordinary_years(congress[index + 1:], {**data_so_far, **{"type": current_heading, "trial": 1}})
+        parse_ordinary_years(spans, index + 1, stop, context._replace(type=current_heading, trial=1), rows)
     if current_heading == "RunoffElections":
-        parse_runoff_states(congress[index + 1:], {**data_so_far, **{"type": current_heading}})
+        parse_runoff_states(spans, index + 1, stop, context._replace(type=current_heading), rows)
 
 
 def parse_out_subheadings(subheading):
-    name = subheading.find("b").text
-    name = "".join(name.split())
+    name = "".join(subheading.bold_text.split())
     if name in ["RunoffElections", "SpecialElections", "StatisticalSummary", "IncompleteReturns",
                 "ElectionsinRestoredAreas", "RejectedandUndeterminedElections"]:
         return name
     else:
-        warnings.warn("Subheader not successfully parsed." + "\n" + name)
+        instrumentation.problem("subheader not parsed", "Subheader not successfully parsed.", name)
 
 
-def parse_ordinary_years(all_ordinary, data_so_far):
-    index = -1
+@instrumentation.timed
+def parse_ordinary_years(spans, start, stop, context, rows):
+    index = None
     current_year = -1
-    for i, span in enumerate(all_ordinary):
-        if is_year(span):
-            if index != -1:
-                new_data = {**data_so_far, **{"year": current_year}}
-                parse_ordinary_states(all_ordinary[index+1: i], new_data)
+    for i in range(start, stop):
+        span = spans[i]
+        if span.kind & YEAR:
+            if index is not None:
+                parse_ordinary_states(spans, index + 1, i, context._replace(year=current_year), rows)
             index = i
             current_year = parse_out_ordinary_years(span)
-    parse_ordinary_states(all_ordinary[index:], {**data_so_far, **{"year": current_year}})
+    # the year span itself is kept in the last range, and without any year only the last span is
+    if index is None:
+        index = max(stop - 1, start)
+    parse_ordinary_states(spans, index, stop, context._replace(year=current_year), rows)
 
 
 def parse_out_ordinary_years(span):
     if letters.match(span.text):
-        warnings.warn("Year contains letters \n" + str(span.parent.parent))
-    return "".join(span.text.split())
-
-
-def parse_runoff_states(all_runoff, data_so_far):
-    index = -1
-    current_state_info = {"state": ""}
-    i = 0
-    while i < len(all_runoff):
-        span = all_runoff[i]
-        if is_state(span):
-            name = get_state_text(span)
-            if index != -1:
-                new_data = {**data_so_far, **current_state_info}
-                parse_runoff_trials(all_runoff[index + 1: i], new_data)
+        instrumentation.problem("year contains letters", "Year contains letters ", span.text)
+    return span.flat_text
+
+
+@instrumentation.timed
+def parse_runoff_states(spans, start, stop, context, rows):
+    index = start - 1
+    current_state = ""
+    for i in range(start, stop):
+        span = spans[i]
+        if span.kind & STATE:
+            name = span.state_text
+            if index != start - 1:
+                parse_runoff_trials(spans, index + 1, i, context._replace(state=current_state), rows)
             index = i
-            current_state_info = {"state": name}
-        i += 1
-    parse_runoff_trials(all_runoff[index + 1: i], {**current_state_info, **data_so_far})
+            current_state = name
+    parse_runoff_trials(spans, index + 1, stop, context._replace(state=current_state), rows)
 
 
-def parse_runoff_trials(runoff_state, data_so_far):
-    index = -1
+@instrumentation.timed
+def parse_runoff_trials(spans, start, stop, context, rows):
+    index = start - 1
     current_trial_info = {"trial": 2, "election_dates": ""}
-    i = 0
-    while i < len(runoff_state):
-        span = runoff_state[i]
-        if is_trial(span):
-            temp_name = get_flat_text(span)
+    i = start
+    while i < stop:
+        span = spans[i]
+        if span.kind & TRIAL:
+            temp_name = span.flat_text
             original_i = i
             valid = True
             while not trial_regex.match(temp_name):
                 try:
-                    temp_name += get_flat_text(runoff_state[i + 1])
+                    temp_name += span_at(spans, i + 1, stop).flat_text
                     i += 1
                 except IndexError:
                     i = original_i
-                    warnings.warn("Trial not parsed." + "\n" + temp_name + str(data_so_far))
+                    instrumentation.problem("trial not parsed", "Trial not parsed.", temp_name, context)
                     valid = False
                     break
             if valid:
-                if index != -1:
-                    new_data = {**data_so_far, **current_trial_info}
-                    parse_ordinary_districts(runoff_state[index + 1: original_i], new_data)
+                if index != start - 1:
+                    parse_ordinary_districts(spans, index + 1, original_i, context._replace(**current_trial_info),
+                                             rows)
                 index = i
                 current_trial_info = parse_out_trial(temp_name)
         i += 1
-    parse_ordinary_districts(runoff_state[index + 1:], {**data_so_far, **current_trial_info})
+    parse_ordinary_districts(spans, index + 1, stop, context._replace(**current_trial_info), rows)
 
 
-def parse_ordinary_states(ordinary_year, data_so_far):
-    index = -1
+@instrumentation.timed
+def parse_ordinary_states(spans, start, stop, context, rows):
+    index = start - 1
     current_state_info = {"state": "", "election_dates": ""}
 
-    i = 0
-    while i < len(ordinary_year):
-        span = ordinary_year[i]
-        if is_state(span):
-            temp_name = get_state_text(span)
+    i = start
+    while i < stop:
+        span = spans[i]
+        if span.kind & STATE:
+            temp_name = span.state_text
             original_i = i
             valid = True
             while not state_regex.match(temp_name):
                 try:
-                    temp_name += get_state_text(ordinary_year[i + 1])
+                    temp_name += span_at(spans, i + 1, stop).state_text
                     i += 1
                 except IndexError:
                     i = original_i
-                    warnings.warn("State not parsed." + "\n" + temp_name + str(data_so_far))
+                    instrumentation.problem("state not parsed", "State not parsed.", temp_name, context)
                     valid = False
                     break
             if valid:
-                if index != -1:
-                    new_data = {**data_so_far, **current_state_info}
-                    parse_ordinary_districts(ordinary_year[index + 1: original_i], new_data)
+                if index != start - 1:
+                    parse_ordinary_districts(spans, index + 1, original_i, context._replace(**current_state_info),
+                                             rows)
                 index = i
                 current_state_info = parse_out_state(temp_name)
         i += 1
-    parse_ordinary_districts(ordinary_year[index + 1:], {**data_so_far, **current_state_info})
+    parse_ordinary_districts(spans, index + 1, stop, context._replace(**current_state_info), rows)
 
 
-def get_flat_text(span):
-    info = "".join(span.text.split())
-    return info
+def span_at(spans, i, stop):
+    # lookahead within a (start, stop) range; running off the end behaves like indexing past a slice
+    if i >= stop:
+        raise IndexError(i)
+    return spans[i]
 
 
 def parse_out_state(info):
@@ -366,35 +486,38 @@ def parse_out_trial(info):
     return {"trial": trial_name, "election_dates": dates, "year": int(year)}
 
 
-def parse_ordinary_districts(state, data_so_far):
-    index = -1
+@instrumentation.timed
+def parse_ordinary_districts(spans, start, stop, context, rows):
+    index = start - 1
     current_district = {"district": "", "num_elected": 0}
-    i = 0
-    while i < len(state):
-        span = state[i]
-        if is_district(span):
+    i = start
+    while i < stop:
+        span = spans[i]
+        if span.kind & DISTRICT:
             original_i = i
-            district_so_far = span.find("i").text
+            district_so_far = span.italic_text
             if "District" not in district_so_far and "At-Large" not in district_so_far and \
                             len(district_so_far) > 1 and not only_numbers.match(district_so_far):
                 try:
-                    district_so_far += " " + state[i+1].find("i").text
+                    district_so_far += " " + span_at(spans, i + 1, stop).italic_text
                     i += 1
-                except AttributeError:
+                except TypeError:
                     pass
                 except IndexError:
                     pass
             if not letters.search(district_so_far):
-                warnings.warn("Started to find a district, but did not complete \n" + district_so_far + str(data_so_far))
+                instrumentation.problem("district incomplete", "Started to find a district, but did not complete ",
+                                        district_so_far, context)
                 i = original_i + 1
                 continue
             valid = True
             while " ".join(district_so_far.split())[-1] == "-" and letters.search(district_so_far):
                 try:
-                    district_so_far += " " + state[i+1].find("i").text
+                    district_so_far += " " + span_at(spans, i + 1, stop).italic_text
                     i += 1
-                except AttributeError:
-                    warnings.warn("Started to find a district, but did not complete \n" + district_so_far + str(data_so_far))
+                except TypeError:
+                    instrumentation.problem("district incomplete", "Started to find a district, but did not complete ",
+                                            district_so_far, context)
                     i = original_i + 1
                     valid = False
                     break
@@ -402,15 +525,15 @@ def parse_ordinary_districts(state, data_so_far):
                 continue
             if "(" in district_so_far and ")" not in district_so_far:
                 try:
-                    district_so_far += " " + state[i+1].find("i").text
+                    district_so_far += " " + span_at(spans, i + 1, stop).italic_text
                     i += 1
-                except AttributeError:
-                    warnings.warn("Started to find a district, but did not complete \n" + district_so_far + str(data_so_far))
+                except TypeError:
+                    instrumentation.problem("district incomplete", "Started to find a district, but did not complete ",
+                                            district_so_far, context)
                     i = original_i + 1
                     continue
-            if index != -1:
-                new_data = {**data_so_far, **current_district}
-                parse_candidates(state[index + 1: original_i], new_data)
+            if index != start - 1:
+                parse_candidates(spans, index + 1, original_i, context._replace(**current_district), rows)
             index = i
             result = parse_out_district(district_so_far)
             if result:
@@ -418,7 +541,7 @@ def parse_ordinary_districts(state, data_so_far):
         i += 1
     if current_district["district"] == "":
         current_district = {"district": "Single", "num_elected": 1}
-    parse_candidates(state[index+1:], {**data_so_far, **current_district})
+    parse_candidates(spans, index + 1, stop, context._replace(**current_district), rows)
 
 
 def parse_out_district(district_info):
@@ -433,7 +556,7 @@ def parse_out_district(district_info):
             num_elected = word_to_number(district_info.split("(")[-1].strip(")").split()[0])
         return {"district": district, "num_elected": num_elected}
     else:
-        warnings.warn("District not parsed" + "\n" + district_info )
+        instrumentation.problem("district not parsed", "District not parsed", district_info)
 
 def word_to_number(string):
     try:
@@ -441,73 +564,71 @@ def word_to_number(string):
     except ValueError:
         return word_to_num[string]
 
-def parse_candidates(district, data_so_far):
-    i = 0
-    text_list = []
-    while i < len(district):
+@instrumentation.timed
+def parse_candidates(spans, start, stop, context, rows):
+    i = start
+    candidate_list = []
+    while i < stop:
 
-        span = district[i]
+        span = spans[i]
         text = span.text
-        score = candidate_completeness_score(text)
-        if score == 5:
-            parse_candidate(text)
-        elif score > 0:
+        score, match = scan_candidate_text(text)
+        if 0 < score < 5:
             j = 1
-            if i + j < len(district):
-                new_text = text + " " + district[i+j].text
-                new_score = candidate_completeness_score(new_text)
+            if i + j < stop:
+                new_text, new_score, new_match = extend_candidate_text(text, score, spans[i+j].text)
                 if new_score == 5:
-                    score = new_score
+                    score, match = new_score, new_match
                     text = new_text
                     j += 1
                 else:
                     while score < new_score:
-                        if i+j >= len(district) - 1:
-                            score = new_score
+                        if i+j >= stop - 1:
+                            score, match = new_score, new_match
                             text = new_text
                             j += 1
                             break
                         j += 1
-                        score = new_score
+                        score, match = new_score, new_match
                         text = new_text
-                        new_text = text + " " + district[i+j].text
-                        new_score = candidate_completeness_score(new_text)
+                        new_text, new_score, new_match = extend_candidate_text(text, score, spans[i+j].text)
                         if new_score == 5:
-                            score = new_score
+                            score, match = new_score, new_match
                             text = new_text
                             j += 1
                             break
             i = i + j - 1
         if score == 1:
-            warnings.warn("Only found the star.")
+            instrumentation.problem("only found the star", "Only found the star.")
         if score == 2:
             if "Congress" not in text:
-                warnings.warn("Please investigate.\n" + text + str(data_so_far))
-                text_list.append(text)
+                instrumentation.problem("candidate without votes or party", "Please investigate.", text, context)
+                candidate_list.append(parse_candidate_name(text))
         elif score != 0:
-            create_candidate_list_from_string(text, text_list, score)
+            create_candidate_list_from_string(text, candidate_list, score, match)
         # else:
         #     print(text)
         i += 1
     runoff = False
     final_candidate_list = []
-    for candidate in text_list:
-        result = parse_candidate(candidate)
+    for result in candidate_list:
         if result:
             if result["runoff"]:
                 runoff = True
             final_candidate_list.append(result)
     final_candidate_list = sorted(final_candidate_list, key=candidate_sort, reverse=True)
+    # every row of every race with the same state, year, etc. shares one copy of each value
+    context = Context(*(sys.intern(value) if type(value) is str else value for value in context))
     for i, candidate in enumerate(final_candidate_list):
-        if i < data_so_far["num_elected"] and not candidate["runoff"]:
+        if i < context.num_elected and not candidate["runoff"]:
             candidate["result"] = "won"
         elif runoff:
             candidate["result"] = "runoff"
         else:
             candidate["result"] = "lost"
-        candidate["runoff"] = runoff
-        final_writing = {**candidate, **data_so_far}
-        writer.writerow(final_writing)
+        rows.append(Row(context.congress, context.type, context.year, context.election_dates, context.state,
+                        context.district, runoff, context.trial, context.num_elected, candidate["name"],
+                        candidate["party"], candidate["votes"], candidate["percentage"], candidate["result"]))
 
 
 
@@ -518,43 +639,65 @@ def candidate_sort(x):
         return 0
 
 
-def create_candidate_list_from_string(text, text_list, score):
-    if score == 3:
-        regex = candidate_completeness_regex_3
-    elif score == 4:
-        regex = candidate_completeness_regex_4
-    elif score == 5:
-        regex = candidate_completeness_regex_5
+def create_candidate_list_from_string(text, candidate_list, score, match):
+    # match is the first hit of the score's regex, as found by scan_candidate_text
+    regex = completeness_regexes[score]
+    prefilter = completeness_prefilters[score]
     pos = 0
-    while pos < len(text):
-        match = regex.search(text, pos)
-        if match:
-            new_pos = match.end()
-            if new_pos == pos:
-                break
-            text_list.append(text[pos:new_pos])
-            pos = new_pos
+    while match and match.end() != pos:
+        if match.start() == pos:
+            candidate_list.append(candidate_from_match(match, score))
         else:
+            candidate_list.append(parse_candidate(text[pos:match.end()]))
+        pos = match.end()
+        match = regex.search(text, pos) if pos < len(text) and prefilter.search(text, pos) else None
+
+
+def scan_candidate_text(string, floor=0, appended=None):
+    # the prefilters are cheap necessary conditions for each level, so the backtracking-heavy
+    # completeness regexes only run on strings that can actually match them
+    for score in (5, 4, 3):
+        if score <= floor:
             break
+        if completeness_prefilters[score].search(string):
+            match = completeness_regexes[score].search(string)
+            if match:
+                return score, match
+    return max(floor, low_completeness_score(string if appended is None else appended)), None
 
 
-def candidate_completeness_score(string):
-    if candidate_completeness_regex_5.search(string):
-        return 5
-    if candidate_completeness_regex_4.search(string):
-        return 4
-    if candidate_completeness_regex_3.search(string):
-        return 3
-    if candidate_completeness_regex_2.search(string):
+def low_completeness_score(string):
+    if letters.search(string):
         return 2
-    if candidate_completeness_regex_1.search(string):
+    if "*" in string:
         return 1
     return 0
 
 
+def extend_candidate_text(text, score, span_text):
+    # a match in text is still a match once another span is appended, so the score can only go up:
+    # only the levels above it are searched, and levels 1 and 2 only depend on the appended span
+    new_text = text + " " + span_text
+    new_score, new_match = scan_candidate_text(new_text, score, span_text)
+    return new_text, new_score, new_match
+
+
 def parse_candidate(string):
-    match = candidate_completeness_regex_5.match(string)
+    for score, regex in sorted(completeness_regexes.items(), reverse=True):
+        match = regex.match(string)
+        if match:
+            return candidate_from_match(match, score)
+    return parse_candidate_name(string)
+
+
+def parse_candidate_name(string):
+    match = candidate_completeness_regex_2_everything.match(string)
     if match:
+        return candidate_from_match(match, 2)
+
+
+def candidate_from_match(match, score):
+    if score == 5 or score == 4:
         if match.group(4):
             party = "".join(match.group(4).split()).split(",")[0].split("/")[0]
         else:
@@ -563,24 +706,10 @@ def parse_candidate(string):
             "name": " ".join(match.group(2).split()),
             "party": party,
             "votes": int(" ".join(match.group(5).split()).replace(",", "")),
-            "percentage": float(" ".join(match.group(6).split())),
+            "percentage": float(" ".join(match.group(6).split())) if score == 5 else None,
             "runoff": bool(match.group(1))
         }
-    match = candidate_completeness_regex_4.match(string)
-    if match:
-        if match.group(4):
-            party = "".join(match.group(4).split()).split(",")[0].split("/")[0]
-        else:
-            party = None
-        return {
-            "name": " ".join(match.group(2).split()),
-            "party": party,
-            "votes": int(" ".join(match.group(5).split()).replace(",", "")),
-            "runoff": bool(match.group(1)),
-            "percentage": None
-        }
-    match = candidate_completeness_regex_3.match(string)
-    if match:
+    if score == 3:
         return {
             "name": " ".join(match.group(2).split()),
             "party": match.group(3).split(",")[0].split("/")[0],
@@ -588,14 +717,144 @@ def parse_candidate(string):
             "runoff": bool(match.group(1)),
             "percentage": None
         }
-    match = candidate_completeness_regex_2_everything.match(string)
-    if match:
-        return {
-            "name": " ".join(match.group(2).split()),
-            "party": None,
-            "votes": None,
-            "runoff": bool(match.group(1)),
-            "percentage": None
-        }
+    return {
+        "name": " ".join(match.group(2).split()),
+        "party": None,
+        "votes": None,
+        "runoff": bool(match.group(1)),
+        "percentage": None
+    }
+
 
-print(parse_out_congress(soup))
\ No newline at end of file
+def parse_file(path, stream=False, cache_dir=None, cache_size=1000, flatten=False):
+    rows = []
+    cache = ParseCache(cache_dir, parser_version(), cache_size) if cache_dir else None
+    parse_out_congress(stream_spans(path) if stream else soup_spans(path, flatten), rows, cache)
+    if cache:
+        cache.prune()
+    return rows
+
+
+def parse_html(source, stream=False, flatten=False):
+    # source is a path or the HTML itself, as bytes
+    rows = []
+    parse_out_congress(stream_spans(source) if stream else soup_spans(source, flatten), rows)
+    return rows
+
+
+def parser_version():
+    # cached rows are only reused by the exact parser source that produced them
+    return source_version(__file__)
+
+
+def congress_order(row):
+    try:
+        return int(row.congress)
+    except ValueError:
+        return 0
+
+
+def file_spans(path, stream=False, flatten=False):
+    return list(stream_spans(path)) if stream else soup_spans(path, flatten)
+
+
+def file_spans_with_report(path, stream, flatten, emit_warnings):
+    # runs in a worker process, so the instrumentation is sent back along with the spans
+    instrumentation.reset()
+    instrumentation.emit_warnings = emit_warnings
+    return file_spans(path, stream, flatten), instrumentation.as_dict()
+
+
+def parse_block_with_report(congress, block, start, emit_warnings):
+    instrumentation.reset()
+    instrumentation.emit_warnings = emit_warnings
+    block_rows, problems = parse_block(congress, block, start)
+    return block_rows, problems, instrumentation.as_dict()
+
+
+def read_files(paths, stream=False, flatten=False, pool=None):
+    # the spans of every batch file, joined in file order: a congress that runs over from one
+    # file into the next keeps its year, state and district in the second file
+    if pool is None or len(paths) == 1:
+        return [span for path in paths for span in file_spans(path, stream, flatten)]
+    spans = []
+    for batch_spans, report in pool.map(file_spans_with_report, paths, [stream] * len(paths),
+                                        [flatten] * len(paths), [instrumentation.emit_warnings] * len(paths)):
+        instrumentation.merge(report)
+        spans.extend(batch_spans)
+    return spans
+
+
+def parse_blocks(blocks, workers=None, cache_dir=None, cache_size=1000, pool=None):
+    # blocks as cut by congress_blocks. Cached blocks are read back here and the others are parsed
+    # in worker processes; the rows come back in block order.
+    cache = ParseCache(cache_dir, parser_version(), cache_size) if cache_dir else None
+    keys = [block_key(congress, block[start:]) if cache else None for congress, block, start in blocks]
+    results = [cached_block(cache, key) if cache else None for key in keys]
+    misses = [n for n, block_rows in enumerate(results) if block_rows is None]
+    if workers == 1 or len(misses) <= 1:
+        parsed = [parse_block(*blocks[n]) for n in misses]
+    elif pool is None:
+        with ProcessPoolExecutor(workers) as pool:
+            parsed = parse_blocks_in(pool, [blocks[n] for n in misses])
+    else:
+        parsed = parse_blocks_in(pool, [blocks[n] for n in misses])
+    for n, (block_rows, problems) in zip(misses, parsed):
+        results[n] = block_rows
+        if cache:
+            cache.put(keys[n], {"rows": block_rows, "problems": problems})
+    if cache:
+        cache.prune()
+    return [row for block_rows in results for row in block_rows]
+
+
+def parse_blocks_in(pool, blocks):
+    parsed = []
+    congresses, spans, starts = zip(*blocks)
+    for block_rows, problems, report in pool.map(parse_block_with_report, congresses, spans, starts,
+                                                 [instrumentation.emit_warnings] * len(blocks)):
+        instrumentation.merge(report)
+        parsed.append((block_rows, problems))
+    return parsed
+
+
+def parse_files(paths, stream=False, workers=None, cache_dir=None, cache_size=1000, flatten=False):
+    # the files are read in parallel, then each congress block is parsed in parallel
+    if workers == 1:
+        rows = parse_blocks(list(congress_blocks(read_files(paths, stream, flatten))), 1, cache_dir, cache_size)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            blocks = list(congress_blocks(read_files(paths, stream, flatten, pool)))
+            rows = parse_blocks(blocks, workers, cache_dir, cache_size, pool)
+    # sorted() is stable, so rows keep their document order within a congress
+    return sorted(rows, key=congress_order)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("inputs", nargs="*", default=["1-150.html"], help="OCR'd HTML page batches")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="read the HTML incrementally with lxml instead of building the whole soup")
+    arg_parser.add_argument("--flatten-tables", action="store_true",
+                            help="read multi-column tables left by the OCR column by column (not with --stream)")
+    arg_parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    arg_parser.add_argument("--output", default="output.csv")
+    arg_parser.add_argument("--cache", help="directory for cached rows; only changed congress blocks are re-parsed")
+    arg_parser.add_argument("--cache-size", type=int, default=1000, help="number of congress blocks to keep cached")
+    arg_parser.add_argument("--columnar", help="also write the rows to a typed Parquet (or .arrow) file")
+    arg_parser.add_argument("--sqlite", help="also load the rows into this SQLite election database")
+    arg_parser.add_argument("--report", help="write call counts, timings and parse problems to this JSON file")
+    arg_parser.add_argument("--warnings", action="store_true", help="also raise a warning for every parse problem")
+    args = arg_parser.parse_args()
+    if args.stream and args.flatten_tables:
+        arg_parser.error("--flatten-tables needs the whole page, so it cannot be combined with --stream")
+    instrumentation.emit_warnings = args.warnings
+    rows = parse_files(args.inputs, args.stream, args.workers, args.cache, args.cache_size, args.flatten_tables)
+    sinks = [CsvSink(args.output, fieldnames)]
+    if args.columnar:
+        sinks.append(ColumnarSink(args.columnar, fieldnames))
+    if args.sqlite:
+        sinks.append(SqliteSink(args.sqlite))
+    write_rows(rows, sinks)
+    if args.report:
+        instrumentation.write_report(args.report)
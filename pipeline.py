@@ -0,0 +1,303 @@
+from aggregate_cube import AggregateCube, read_state_areas
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from efficiency_gap import efficiency_gaps, seat_shares
+from flatten_table import flattened_html
+from incumbency_analysis import compute_incumbency
+from parse_cache import source_version
+from parse_out_votes import journal_files, parse_journal_file, write_roll_call
+from parser import congress_blocks, congress_order, fieldnames, file_spans, parse_blocks
+from sinks import CsvSink, write_rows
+import aggregate_cube
+import argparse
+import asyncio
+import candidate_identity
+import csv
+import efficiency_gap
+import flatten_table
+import functools
+import hashlib
+import instrumentation
+import io
+import json
+import os
+import pandas as pd
+import parse_cache
+import parser
+import pickle
+import sinks
+import sys
+import time
+
+# runs flatten -> parse -> incumbency -> gaps and aggregates, and the roll calls alongside, as a DAG.
+# Every stage's result is stored under the hash of its content, and a stage is keyed by its code
+# (the module defining it and the project modules it uses), its arguments, the input files it reads
+# and the content hashes of the stages it uses. A stage whose key has been seen before is not run.
+# A stage whose result comes out the same as before leaves the stages after it untouched. Results
+# are handed on in memory.
+# Each page stage only reads the page's spans; the spans of all pages are then joined in page order
+# and cut into congress blocks, so a congress that runs over from one page batch into the next is
+# parsed whole. After a fix to one page only that page is re-read and, through the parse cache, only
+# its changed congress blocks are re-parsed.
+
+
+class Stage(namedtuple("Stage", ["name", "function", "inputs", "args", "files", "sources", "output", "write",
+                                 "processes"])):
+    # function(*input results, *args) is run in a worker process if processes is set, otherwise in a
+    # thread. write(result, output) saves the result to the file the scripts would have written.
+    # sources are the project modules whose code the function or write uses, besides the ones defining them.
+    __slots__ = ()
+
+    def source_files(self):
+        return module_files(sys.modules[self.function.__module__], *self.sources)
+
+    def writer_version(self):
+        # a change to write rewrites the output even when the result is the same
+        return source_version(*module_files(sys.modules[self.write.__module__], *self.sources))
+
+
+def module_files(*modules):
+    return sorted({os.path.abspath(module.__file__) for module in modules})
+
+
+def file_digest(path):
+    hasher = hashlib.sha1()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def content_digest(value):
+    hasher = hashlib.sha1()
+    if isinstance(value, pd.DataFrame):
+        hasher.update(repr(list(value.columns)).encode())
+        hasher.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, (bytes, list)):
+        # parsed rows share interned strings, which pickle would record differently from run to run
+        hasher.update(value if isinstance(value, bytes) else repr(value).encode())
+    else:
+        hasher.update(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    return hasher.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, store=".pipeline"):
+        self.store = store
+        self.stages = {}
+        self.manifest = {"stages": {}, "outputs": {}}
+        self.manifest_path = os.path.join(store, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self.ran = []
+
+    def add(self, name, function, inputs=(), args=(), files=(), sources=(), output=None, write=None,
+            processes=False):
+        self.stages[name] = Stage(name, function, tuple(inputs), tuple(args), tuple(files), tuple(sources),
+                                  output, write, processes)
+
+    def artifact_path(self, digest):
+        return os.path.join(self.store, digest + ".pickle")
+
+    def stage_key(self, stage, input_digests):
+        hasher = hashlib.sha1(stage.name.encode())
+        hasher.update(stage.function.__qualname__.encode())
+        hasher.update(source_version(*stage.source_files()).encode())
+        hasher.update(repr(stage.args).encode())
+        for path in stage.files:
+            hasher.update(file_digest(path).encode())
+        for digest in input_digests:
+            hasher.update(digest.encode())
+        return hasher.hexdigest()
+
+    def save_artifact(self, digest, value):
+        path = self.artifact_path(digest)
+        with open(path + ".tmp", "wb") as artifact_file:
+            pickle.dump(value, artifact_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def load_artifact(self, digest):
+        with open(self.artifact_path(digest), "rb") as artifact_file:
+            return pickle.load(artifact_file)
+
+    def digest(self, name):
+        # the content hash of a stage's result, building the stage first if it is stale
+        if name not in self.digests:
+            self.digests[name] = asyncio.ensure_future(self.build_stage(self.stages[name]))
+        return self.digests[name]
+
+    def value(self, name):
+        # a stage's result, read back from the store if the stage did not run
+        if name not in self.values:
+            self.values[name] = asyncio.ensure_future(self.load_value(name))
+        return self.values[name]
+
+    async def load_value(self, name):
+        digest = await self.digest(name)
+        return await asyncio.get_running_loop().run_in_executor(None, self.load_artifact, digest)
+
+    async def build_stage(self, stage):
+        loop = asyncio.get_running_loop()
+        input_digests = await asyncio.gather(*(self.digest(name) for name in stage.inputs))
+        key = await loop.run_in_executor(None, self.stage_key, stage, input_digests)
+        digest = self.manifest["stages"].get(key)
+        value = None
+        if digest is None or not os.path.exists(self.artifact_path(digest)):
+            inputs = await asyncio.gather(*(self.value(name) for name in stage.inputs))
+            started = time.perf_counter()
+            value = await loop.run_in_executor(self.pool if stage.processes else None,
+                                               functools.partial(stage.function, *inputs, *stage.args))
+            digest = await loop.run_in_executor(None, content_digest, value)
+            await loop.run_in_executor(None, self.save_artifact, digest, value)
+            self.ran.append((stage.name, time.perf_counter() - started))
+            future = loop.create_future()
+            future.set_result(value)
+            self.values[stage.name] = future
+        self.used[key] = digest
+        written = digest + ":" + await loop.run_in_executor(None, stage.writer_version) if stage.output else None
+        if stage.output and (self.manifest["outputs"].get(stage.output) != written or
+                             not os.path.exists(stage.output)):
+            if value is None:
+                value = await loop.run_in_executor(None, self.load_artifact, digest)
+            await loop.run_in_executor(None, stage.write, value, stage.output)
+            self.manifest["outputs"][stage.output] = written
+        return digest
+
+    async def build_all(self, workers=None):
+        with ProcessPoolExecutor(workers) as self.pool:
+            await asyncio.gather(*(self.digest(name) for name in self.stages))
+
+    def build(self, workers=None):
+        os.makedirs(self.store, exist_ok=True)
+        self.digests, self.values, self.used, self.ran = {}, {}, {}, []
+        try:
+            asyncio.run(self.build_all(workers))
+        finally:
+            self.manifest["stages"].update(self.used)
+            with open(self.manifest_path + ".tmp", "w") as manifest_file:
+                json.dump(self.manifest, manifest_file)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        return self.ran
+
+    def prune(self):
+        # forgets every stage and result not used by the last build
+        self.manifest["stages"] = self.used
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        kept = set(self.used.values())
+        for entry in os.listdir(self.store):
+            if entry.endswith(".pickle") and entry[:-len(".pickle")] not in kept:
+                os.remove(os.path.join(self.store, entry))
+
+
+def page_blocks(*pages):
+    return list(congress_blocks(span for spans in pages for span in spans))
+
+
+def election_rows(blocks, workers=None, cache_dir=None, cache_size=1000):
+    # sorted() is stable, so rows keep their document order within a congress, as in parse_files
+    return sorted(parse_blocks(blocks, workers, cache_dir, cache_size), key=congress_order)
+
+
+def election_table(rows):
+    # the rows are read as incumbency_analysis.py reads output.csv, so every column gets the same type
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
+    text.seek(0)
+    return pd.read_csv(text)
+
+
+def filtered_gaps(data):
+    return efficiency_gaps(seat_shares(data))
+
+
+def state_cube(data, areas_path):
+    cube = AggregateCube(read_state_areas(areas_path))
+    cube.update(data)
+    return cube
+
+
+def roll_call_rows(*journals):
+    return [row for rows in journals for row in rows]
+
+
+def write_election_rows(rows, path):
+    write_rows(rows, [CsvSink(path, fieldnames)])
+
+
+def write_frame(frame, path):
+    frame.to_csv(path)
+
+
+def write_filtered(filtered, path):
+    filtered = filtered.copy()
+    filtered.index += 1  # R's row names
+    filtered.to_csv(path)
+
+
+def write_cube(cube, path):
+    cube.save(path)
+
+
+def election_pipeline(pages, journals=(), store=".pipeline", flatten=False, areas="state_area.csv",
+                      cache_size=1000, workers=None, votes_output="roll_calls.csv"):
+    pipeline = Pipeline(store)
+    blocks = os.path.join(store, "blocks")
+    page_stages = []
+    for path in pages:
+        name = "spans:" + path
+        if flatten:
+            pipeline.add("flatten:" + path, flattened_html, args=[path], files=[path], processes=True)
+            pipeline.add(name, file_spans, inputs=["flatten:" + path], sources=[flatten_table, instrumentation],
+                         processes=True)
+        else:
+            pipeline.add(name, file_spans, args=[path], files=[path], sources=[flatten_table, instrumentation],
+                         processes=True)
+        page_stages.append(name)
+    pipeline.add("blocks", page_blocks, inputs=page_stages, sources=[parser, instrumentation])
+    # run in a thread: only the blocks missing from the parse cache are sent to worker processes
+    pipeline.add("elections", election_rows, inputs=["blocks"], args=[workers, blocks, cache_size],
+                 sources=[parser, parse_cache, instrumentation, sinks], output="output.csv",
+                 write=write_election_rows)
+    pipeline.add("election_table", election_table, inputs=["elections"], sources=[parser])
+    pipeline.add("incumbency", compute_incumbency, inputs=["election_table"], sources=[candidate_identity],
+                 output="output_with_incumbency.csv", write=write_frame)
+    pipeline.add("gaps", filtered_gaps, inputs=["incumbency"], sources=[efficiency_gap], output="filtered.csv",
+                 write=write_filtered)
+    pipeline.add("aggregates", state_cube, inputs=["incumbency"], args=[areas], files=[areas],
+                 sources=[aggregate_cube, efficiency_gap], output="aggregate_cube.npz", write=write_cube)
+    journal_stages = []
+    for path in journal_files(journals):
+        pipeline.add("votes:" + path, parse_journal_file, args=[path], files=[path], processes=True)
+        journal_stages.append("votes:" + path)
+    if journal_stages:
+        pipeline.add("roll_call", roll_call_rows, inputs=journal_stages, output=votes_output, write=write_roll_call)
+    return pipeline
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("pages", nargs="*", default=["1-150.html"],
+                            help="OCR'd HTML page batches, or directories of them")
+    arg_parser.add_argument("--journals", nargs="*", default=[],
+                            help="House Journal pages, or directories of them")
+    # vote_record.csv has hand-corrected names that match clean_name, so it is not written by default
+    arg_parser.add_argument("--votes-output", default="roll_calls.csv", help="csv for the roll calls")
+    arg_parser.add_argument("--store", default=".pipeline", help="directory for the stored stage results")
+    arg_parser.add_argument("--flatten-tables", action="store_true",
+                            help="read multi-column tables left by the OCR column by column")
+    arg_parser.add_argument("--areas", default="state_area.csv")
+    arg_parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    arg_parser.add_argument("--prune", action="store_true", help="drop stored results not used by this build")
+    args = arg_parser.parse_args()
+    pipeline = election_pipeline(list(journal_files(args.pages)), args.journals, args.store, args.flatten_tables,
+                                 args.areas, workers=args.workers, votes_output=args.votes_output)
+    ran = pipeline.build(args.workers)
+    for name, seconds in ran:
+        print("%-40s %8.2fs" % (name, seconds))
+    print("%d of %d stages ran" % (len(ran), len(pipeline.stages)))
+    if args.prune:
+        pipeline.prune()
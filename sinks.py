@@ -0,0 +1,141 @@
+from election_store import ElectionStore
+import csv
+
+# where parsed rows go. Rows are collected into batches and each batch is written in one call
+# (writerows, a Parquet row group, one SQLite transaction). A sink is written completely once it
+# is closed, so use it in a with block or close it explicitly.
+
+
+class RowSink:
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self.batch = []
+
+    def append(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        if self.batch:
+            self.write_batch(self.batch)
+            self.batch = []
+
+    def close(self):
+        self.flush()
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemorySink(RowSink):
+    def __init__(self, batch_size=5000):
+        super().__init__(batch_size)
+        self.rows = []
+
+    def write_batch(self, rows):
+        self.rows.extend(rows)
+
+
+class CsvSink(RowSink):
+    def __init__(self, path, fieldnames, batch_size=5000):
+        super().__init__(batch_size)
+        self.output_file = open(path, "w", newline="")
+        self.writer = csv.writer(self.output_file)
+        self.writer.writerow(fieldnames)
+
+    def write_batch(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        super().close()
+        self.output_file.close()
+
+
+class ColumnarSink(RowSink):
+    # Parquet is written a row group per batch. An Arrow IPC file can only hold one dictionary per
+    # column, so for .arrow/.feather the batches are kept as Arrow tables and combined on close.
+    def __init__(self, path, fieldnames, batch_size=50000):
+        super().__init__(batch_size)
+        # pandas and pyarrow are only needed for columnar output, so they are not imported otherwise
+        import pyarrow as pa
+        from columnar import is_arrow_path
+        self.pa = pa
+        self.path = path
+        self.fieldnames = fieldnames
+        self.tables = [] if is_arrow_path(path) else None
+        self.writer = None
+        self.schema = None
+
+    def to_arrow(self, rows):
+        import pandas as pd
+        from columnar import to_typed_frame
+        table = self.pa.Table.from_pandas(to_typed_frame(pd.DataFrame(rows, columns=self.fieldnames)),
+                                          preserve_index=False)
+        if self.schema is None:
+            # categories differ between batches, so every batch gets the same, wide dictionary index
+            self.schema = self.pa.schema([field.with_type(self.pa.dictionary(self.pa.int32(), field.type.value_type))
+                                          if self.pa.types.is_dictionary(field.type) else field
+                                          for field in table.schema], metadata=table.schema.metadata)
+        return table.cast(self.schema)
+
+    def write_batch(self, rows):
+        table = self.to_arrow(rows)
+        if self.tables is not None:
+            self.tables.append(table)
+            return
+        if self.writer is None:
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.tables is not None:
+            import pyarrow.feather as feather
+            if not self.tables:
+                self.tables.append(self.to_arrow([]))
+            feather.write_feather(self.pa.concat_tables(self.tables).unify_dictionaries(), self.path,
+                                  compression="uncompressed")
+            self.tables = []
+        elif self.writer is None:
+            self.write_batch([])
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class SqliteSink(RowSink):
+    def __init__(self, path, batch_size=5000):
+        super().__init__(batch_size)
+        self.store = ElectionStore(path)
+        self.loaded = set()
+
+    def write_batch(self, rows):
+        # a congress can span several batches, so it is only cleared out the first time it is seen
+        self.loaded |= self.store.load(rows, keep=self.loaded)
+
+    def close(self):
+        super().close()
+        self.store.close()
+
+
+def write_rows(rows, sinks):
+    # sinks are closed even when writing fails, so no file is left open or half flushed
+    try:
+        for row in rows:
+            for sink in sinks:
+                sink.append(row)
+    finally:
+        for sink in sinks:
+            sink.close()